@@ -2,25 +2,75 @@
 # -*- coding: utf-8 -*-
 
 """
-usage: python3 docker_descendants.py <image_id> [<image_id_2> ...] 
+usage: python3 docker_descendants.py [--socket [<path>]] <image_id> [<image_id_2> ...]
+       python3 docker_descendants.py [--socket [<path>]] --serve [--listen <path>]
+       python3 docker_descendants.py --benchmark <number_of_images>
 
 List Docker images dependent on one of the image ids passed as arg
 
+With --socket, talks to the Docker Engine API on its unix socket
+(/var/run/docker.sock by default) instead of running the docker CLI.
+Otherwise the id => parent links are cached in
+~/.cache/docker_dependent_images.json (--cache, --no-cache), and only the
+images missing from the cache are inspected.
+
+With --serve, loads the image graph once, keeps it current from the docker
+events and answers JSON lines queries on stdin, or on the unix socket given
+by --listen, e.g.
+    {"id": 1, "query": "descendants", "roots": ["4e1b5f6a", "9c2f0a1d7e3b"]}
+gets
+    {"id": 1, "query": "descendants", "results": {"4e1b5f6a": [...], ...}}
+query is descendants (default), ancestors or tree. While the events cannot
+be followed (e.g. docker restarting), the answers carry "stale": true until
+the graph is reloaded.
+
 From https://gist.github.com/altaurog/21ea7afe578a523e3dfe8d8a746f1e7d
 """
 
+import argparse
+import codecs
+import contextlib
+import http.client
+import json
+import os
+import random
+import socket
+import socketserver
+import subprocess
 import sys
-from subprocess import check_output
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections import deque
+from subprocess import CalledProcessError, check_output
+
+DOCKER_SOCKET = '/var/run/docker.sock'
+CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'docker_dependent_images.json')
+CACHE_VERSION = 1
+#Image ids per docker inspect run, far below ARG_MAX
+INSPECT_CHUNK = 1000
+#Image events changing the graph: the image is inspected again, or removed on delete
+IMAGE_EVENTS = ('pull', 'tag', 'untag', 'import', 'load', 'delete')
+
+
+def main(images, socket_path=None, cache_path=None):
+    if socket_path is not None:
+        return main_api(images, DockerClient(socket_path))
+    if cache_path is None:
+        links = parse_links(docker_links(docker_images('--all', '--quiet')))
+    else:
+        links = cached_links(docker_images('--all', '--quiet', '--no-trunc'), cache_path)
+    index = children_index(links)
+    descendants = desc(set(images), index)
+    return filter_images(docker_images(), images, descendants)
 
 
-def main(images):
-    image_ids = set(images)
-    all_images = docker_images('--all', '--quiet')
-    all_links = parse_links(docker_links(all_images))
-    descendants = desc(image_ids, all_links)
-    pred = lambda s: lambda line: s[:12] in line
-    match = list(map(pred, descendants))
-    return filter(lambda i: any(s(i) for s in match), docker_images())
+def main_api(images, client):
+    records = list(client.images())
+    index = children_index(api_links(records))
+    descendants = desc(set(images), index)
+    return filter_images(api_image_lines(records, index), images, descendants)
 
 
 def parse_links(lines):
@@ -29,21 +79,234 @@ def parse_links(lines):
         yield list(map(parseid, line.split()))
 
 
-def desc(image_ids, links):
-    if links:
-        link, *tail = links
+def children_index(links):
+    """
+    parent id => list of the ids of its children, built in one pass
+    """
+    index = {}
+    for link in links:
         if len(link) > 1:
             image_id, parent_id = link
-            checkid = lambda i: parent_id.startswith(i)
-            if any(map(checkid, image_ids)):
-                return desc(image_ids | {image_id}, tail)
-        return desc(image_ids, tail)
-    return image_ids
+            index.setdefault(parent_id, []).append(image_id)
+    return index
+
+
+def desc(image_ids, index):
+    """
+    The image ids plus the ids of all their descendants. Like docker, an
+    image id may be given as a prefix of the full id.
+    """
+    roots = [parent_id for parent_id in index
+             if any(map(parent_id.startswith, image_ids))]
+    found = set(image_ids)
+    queue = deque(roots)
+    while queue:
+        for child_id in index.get(queue.popleft(), ()):
+            if child_id not in found:
+                found.add(child_id)
+                queue.append(child_id)
+    return found
+
+
+def filter_images(lines, image_ids, descendants):
+    """
+    The `docker images` lines whose IMAGE ID is a descendant or one of the
+    given ids (which may be short prefixes)
+    """
+    short_ids = {image_id[:12] for image_id in descendants}
+    prefixes = tuple(image_id[:12] for image_id in image_ids)
+    column = lambda line: (line.split()[2:3] or [''])[0]
+    matches = lambda image_id: image_id in short_ids or image_id.startswith(prefixes)
+    return filter(lambda line: matches(column(line)), lines)
+
+
+def api_links(records):
+    """
+    [id, parent id] (or [id]) of the /images/json records, oldest first
+    """
+    parseid = lambda s: s.replace('sha256:', '')
+    for record in reversed(records):
+        yield list(map(parseid, filter(None, (record['Id'], record.get('ParentId')))))
+
+
+def api_image_lines(records, index):
+    """
+    `docker images` like lines (REPOSITORY TAG IMAGE ID) of the /images/json
+    records: one per tag, and untagged images only when they have no children
+    """
+    for record in records:
+        image_id = record['Id'].replace('sha256:', '')
+        tags = [tag for tag in record.get('RepoTags') or () if tag != '<none>:<none>']
+        if not tags and image_id not in index:
+            tags = ['<none>:<none>']
+        for tag in tags:
+            yield '%s   %s   %s' % (*tag.rsplit(':', 1), image_id[:12])
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP/1.1 keep-alive connection to a unix socket
+    """
+
+    def __init__(self, path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class DockerError(RuntimeError):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class DockerClient:
+    """
+    Minimal Docker Engine API client, keeping one connection open to the daemon
+    """
+
+    def __init__(self, path=DOCKER_SOCKET, timeout=60):
+        self.connection = UnixHTTPConnection(path, timeout)
+
+    def get(self, path):
+        try:
+            try:
+                self.connection.request('GET', path)
+                response = self.connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                #The daemon closed the idle connection, reconnect once
+                self.connection.close()
+                self.connection.request('GET', path)
+                response = self.connection.getresponse()
+        except (OSError, http.client.HTTPException):
+            #Never reuse a connection left in the middle of an exchange, e.g. on a timeout
+            self.connection.close()
+            raise
+        if response.status != 200:
+            raise DockerError('GET %s: %d %s' % (path, response.status, response.read().decode('utf-8', 'replace')),
+                              response.status)
+        return response
+
+    def images(self):
+        """
+        Yield the records of /images/json?all=1 as they are received
+        """
+        response = self.get('/images/json?all=1')
+        return iter_json_array(iter(lambda: response.read1(65536), b''))
+
+    def inspect(self, name):
+        """
+        The /images/{name}/json record, None when there is no such image
+        """
+        try:
+            return json.loads(self.get('/images/%s/json' % urllib.parse.quote(name, safe='/:@')).read())
+        except DockerError as error:
+            if error.status == 404:
+                return None
+            raise
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+
+    def events(self, since):
+        """
+        Yield the image events since the given timestamp, and the next ones as
+        they happen. Holds the connection, closed when the generator is: use a
+        dedicated client, without timeout.
+        """
+        filters = urllib.parse.quote(json.dumps({'type': ['image']}))
+        try:
+            response = self.get('/events?since=%d&filters=%s' % (since, filters))
+            yield from iter_json_array(iter(lambda: response.read1(65536), b''))
+        finally:
+            self.close()
+
+    def close(self):
+        self.connection.close()
+
+
+def iter_json_array(chunks):
+    """
+    Yield the items of a JSON array of objects received as chunks of bytes,
+    without holding the whole document
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    position = 0
+    for chunk in chunks:
+        buffer = buffer[position:] + utf8.decode(chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n[,]':
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                break
+            yield item
+
+
+def cached_links(all_images, path):
+    """
+    [id, parent id] (or [id]) of all_images. Only the images missing from the
+    cache at path are inspected, and the cache is rewritten without the images
+    that no longer exist.
+    """
+    parseid = lambda s: s.replace('sha256:', '')
+    image_ids = list(dict.fromkeys(map(parseid, all_images)))
+    cache = load_cache(path)
+    missing = [image_id for image_id in image_ids if image_id not in cache]
+    for link in parse_links(docker_links(missing)):
+        cache[link[0]] = link[1] if len(link) > 1 else ''
+    parents = {image_id: cache[image_id] for image_id in image_ids}
+    if missing or len(parents) != len(cache):
+        save_cache(path, parents)
+    return [[image_id, parent_id] if parent_id else [image_id] for image_id, parent_id in parents.items()]
+
+
+def load_cache(path):
+    """
+    id => parent id ('' for none) from the cache file, empty when it is
+    missing, unreadable or written for another docker daemon
+    """
+    try:
+        with open(path) as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != CACHE_VERSION or cache.get('docker_host') != os.environ.get('DOCKER_HOST', ''):
+        return {}
+    return cache['parents']
+
+
+def save_cache(path, parents):
+    """
+    Atomically replace the cache file: readers see the old or the new one, never a partial one
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix='.docker_dependent_images.')
+    try:
+        with os.fdopen(handle, 'w') as cache_file:
+            json.dump({'version': CACHE_VERSION, 'docker_host': os.environ.get('DOCKER_HOST', ''),
+                       'parents': parents}, cache_file)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
 
 
 def docker_links(images):
     cmd = [ 'docker', 'inspect', '--format={{.Id}} {{.Parent}}']
-    return run(cmd + images)
+    for start in range(0, len(images), INSPECT_CHUNK):
+        yield from run(cmd + images[start:start + INSPECT_CHUNK])
 
 
 def docker_images(*args):
@@ -54,5 +317,365 @@ def run(cmd):
     return check_output(cmd, universal_newlines=True).splitlines()
 
 
+class ImageGraph:
+    """
+    Image id => parent id links and their reverse index, safe to update from
+    the events thread while queries are answered
+    """
+
+    def __init__(self):
+        self.parents = {}
+        self.children = {}
+        self.tags = {}
+        self.tagged = {}
+        self.lock = threading.RLock()
+        #True while the events are not followed, and the graph may be out of date
+        self.stale = False
+
+    def replace(self, other):
+        """
+        Take the links of other, a graph loaded meanwhile, in one step for the queries
+        """
+        with self.lock:
+            self.parents, self.children, self.tags, self.tagged = other.parents, other.children, other.tags, other.tagged
+
+    def add(self, image_id, parent_id='', tags=()):
+        with self.lock:
+            self.remove(image_id, keep_children=True)
+            self.parents[image_id] = parent_id
+            self.tags[image_id] = [tag for tag in tags or () if tag != '<none>:<none>']
+            for tag in self.tags[image_id]:
+                self.tagged[tag] = image_id
+            if parent_id:
+                self.children.setdefault(parent_id, set()).add(image_id)
+
+    def remove(self, image_id, keep_children=False):
+        with self.lock:
+            parent_id = self.parents.pop(image_id, '')
+            for tag in self.tags.pop(image_id, ()):
+                # the tag may already have moved to another image
+                if self.tagged.get(tag) == image_id:
+                    del self.tagged[tag]
+            if parent_id in self.children:
+                self.children[parent_id].discard(image_id)
+                if not self.children[parent_id]:
+                    del self.children[parent_id]
+            if not keep_children:
+                self.children.pop(image_id, None)
+
+    def resolve(self, name):
+        """
+        Full id of the image given by id, id prefix or tag, None when unknown
+        """
+        name = name.replace('sha256:', '')
+        with self.lock:
+            if name in self.parents:
+                return name
+            image_id = self.tagged.get(name) or self.tagged.get(name + ':latest')
+            if image_id is not None:
+                return image_id
+            # only an id prefix needs a scan
+            found = [image_id for image_id in self.parents if image_id.startswith(name)]
+            return found[0] if len(found) == 1 else None
+
+    def descendants(self, name):
+        with self.lock:
+            image_id = self.resolve(name)
+            if image_id is None:
+                return None
+            found = set()
+            queue = deque([image_id])
+            while queue:
+                for child_id in self.children.get(queue.popleft(), ()):
+                    if child_id not in found:
+                        found.add(child_id)
+                        queue.append(child_id)
+            return sorted(found)
+
+    def ancestors(self, name):
+        with self.lock:
+            image_id = self.resolve(name)
+            if image_id is None:
+                return None
+            found = []
+            while self.parents.get(image_id):
+                image_id = self.parents[image_id]
+                found.append(image_id)
+            return found
+
+    def tree(self, name):
+        """
+        Nested {'id', 'tags', 'children'} of the image and its descendants
+        """
+        with self.lock:
+            image_id = self.resolve(name)
+            if image_id is None:
+                return None
+            node = lambda image_id: {'id': image_id, 'tags': self.tags.get(image_id, []), 'children': []}
+            root = node(image_id)
+            queue = deque([root])
+            while queue:
+                parent = queue.popleft()
+                for child_id in sorted(self.children.get(parent['id'], ())):
+                    child = node(child_id)
+                    parent['children'].append(child)
+                    queue.append(child)
+            return root
+
+
+QUERIES = ('descendants', 'ancestors', 'tree')
+
+
+def answer(graph, line):
+    """
+    Answer one JSON lines query, see the module documentation
+    """
+    usage = {'error': 'expected {"query": "descendants|ancestors|tree", "roots": [...]}'}
+    try:
+        request = json.loads(line)
+        query = request.get('query', 'descendants')
+        roots = request['roots']
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return usage
+    if not isinstance(roots, list) or not all(isinstance(root, str) for root in roots):
+        return usage
+    if query not in QUERIES:
+        return {'error': 'unknown query %r, expected one of %s' % (query, ', '.join(QUERIES))}
+    with graph.lock:
+        response = {'query': query, 'results': {root: getattr(graph, query)(root) for root in roots}}
+        if graph.stale:
+            response['stale'] = True
+    if 'id' in request:
+        response['id'] = request['id']
+    return response
+
+
+def serve(graph, lines, write):
+    for line in lines:
+        if line.strip():
+            write(json.dumps(answer(graph, line)) + '\n')
+
+
+class QueryHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        def write(text):
+            self.wfile.write(text.encode('utf-8'))
+            self.wfile.flush()
+        serve(self.server.graph, (line.decode('utf-8') for line in self.rfile), write)
+
+
+class QueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def load_graph(socket_path=None, cache_path=None):
+    """
+    The ImageGraph of the daemon, and a function (since) following its image
+    events to keep the graph current
+    """
+    if socket_path is not None:
+        client = DockerClient(socket_path)
+        def load():
+            graph = ImageGraph()
+            for record in client.images():
+                graph.add(record['Id'].replace('sha256:', ''), record.get('ParentId', '').replace('sha256:', ''),
+                          record.get('RepoTags'))
+            return graph
+        inspect = client.inspect
+        events = lambda since: DockerClient(socket_path, timeout=None).events(since)
+    else:
+        def load():
+            graph = ImageGraph()
+            if cache_path is None:
+                links = parse_links(docker_links(docker_images('--all', '--quiet')))
+            else:
+                links = cached_links(docker_images('--all', '--quiet', '--no-trunc'), cache_path)
+            tags = docker_tags()
+            for link in links:
+                graph.add(link[0], (link[1:] or [''])[0], tags.get(link[0]))
+            return graph
+        inspect = cli_inspect
+        events = cli_events
+    graph = load()
+    return graph, lambda since: follow_events(graph, events, inspect, load, since)
+
+
+def follow_events(graph, events, inspect, load, since, delay=1, max_delay=60):
+    """
+    Apply the image events since the timestamp to graph, forever. When the
+    events stream ends or fails (docker restarted, the connection dropped, an
+    inspect failed), events may be lost: the graph is marked stale, then
+    reloaded and followed again, retrying with a doubling delay.
+    """
+    wait = delay
+    while True:
+        try:
+            if graph.stale:
+                since = int(time.time())
+                graph.replace(load())
+                graph.stale = False
+            with contextlib.closing(events(since)) as stream:
+                for event in stream:
+                    wait = delay
+                    apply_event(graph, event, inspect)
+            error = 'docker events stream closed'
+        except Exception as exception:
+            # the service must outlive any docker failure
+            error = 'docker events failed: %s' % (str(exception) or type(exception).__name__)
+        graph.stale = True
+        print('%s, reloading the image graph in %ds' % (error, wait), file=sys.stderr)
+        time.sleep(wait)
+        wait = min(wait * 2, max_delay)
+
+
+def apply_event(graph, event, inspect):
+    action = event.get('Action') or event.get('status')
+    name = event.get('Actor', {}).get('ID') or event.get('id')
+    if action not in IMAGE_EVENTS or not name:
+        return
+    if action == 'delete':
+        graph.remove(name.replace('sha256:', ''))
+        return
+    record = inspect(name)
+    # Intermediate images of a build have no event: inspect the missing ancestors too
+    while record is not None:
+        parent_id = (record.get('Parent') or '').replace('sha256:', '')
+        graph.add(record['Id'].replace('sha256:', ''), parent_id, record.get('RepoTags'))
+        record = inspect(parent_id) if parent_id and parent_id not in graph.parents else None
+
+
+def cli_inspect(name):
+    try:
+        line, = run(['docker', 'inspect', '--format={{.Id}} {{.Parent}} {{json .RepoTags}}', name])
+    except CalledProcessError:
+        return None
+    image_id, parent_id, tags = line.split(' ', 2)
+    return {'Id': image_id, 'Parent': parent_id, 'RepoTags': json.loads(tags) or []}
+
+
+def docker_tags():
+    """
+    image id => its repository:tag names, from a single docker images run. Tags
+    move between images, so unlike the parent links they are not cached.
+    """
+    tags = {}
+    for line in docker_images('--all', '--no-trunc', '--format', '{{.ID}} {{.Repository}}:{{.Tag}}'):
+        image_id, tag = line.split(' ', 1)
+        if tag != '<none>:<none>':
+            tags.setdefault(image_id.replace('sha256:', ''), []).append(tag)
+    return tags
+
+
+def cli_events(since):
+    cmd = ['docker', 'events', '--format={{json .}}', '--filter', 'type=image', '--since', str(since)]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, universal_newlines=True)
+    try:
+        for line in process.stdout:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        process.kill()
+        process.stdout.close()
+        process.wait()
+
+
+def daemon(socket_path=None, cache_path=None, listen=None):
+    """
+    Serve the JSON lines queries on stdin/stdout, or on the unix socket listen
+    """
+    since = int(time.time())
+    graph, follow = load_graph(socket_path, cache_path)
+    threading.Thread(target=follow, args=(since,), daemon=True).start()
+    if listen is None:
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        serve(graph, sys.stdin, write)
+        return
+    if os.path.exists(listen):
+        os.unlink(listen)
+    server = QueryServer(listen, QueryHandler)
+    server.graph = graph
+    try:
+        server.serve_forever()
+    finally:
+        os.unlink(listen)
+
+
+def benchmark(count):
+    """
+    Time the graph queries on a synthetic store of count images, each one
+    built on a random older image (or on nothing for one in a hundred)
+    """
+    random.seed(count)
+    image_ids = ['%064x' % random.getrandbits(256) for _ in range(count)]
+    lines = [image_ids[0] + ' ']
+    for number, image_id in enumerate(image_ids[1:], 1):
+        parent_id = '' if number % 100 == 0 else 'sha256:' + image_ids[random.randrange(number)]
+        lines.append('sha256:' + image_id + ' ' + parent_id)
+    lines.reverse()
+    images = ['repo%d latest %s 2 days ago 100MB' % (number, image_id[:12])
+              for number, image_id in enumerate(image_ids)]
+
+    start = time.perf_counter()
+    index = children_index(parse_links(lines))
+    indexed = time.perf_counter() - start
+    start = time.perf_counter()
+    descendants = desc({image_ids[0][:12]}, index)
+    searched = time.perf_counter() - start
+    start = time.perf_counter()
+    matched = list(filter_images(images, [image_ids[0][:12]], descendants))
+    filtered = time.perf_counter() - start
+
+    print('%d images, %d descendants, %d lines matched' % (count, len(descendants) - 1, len(matched)))
+    print('  index:  %8.1f ms' % (indexed * 1000))
+    print('  search: %8.1f ms' % (searched * 1000))
+    print('  filter: %8.1f ms' % (filtered * 1000))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'cache.json')
+        save_cache(path, {link[0]: (link[1] if len(link) > 1 else '') for link in parse_links(lines)})
+        start = time.perf_counter()
+        cached = cached_links([line.split()[0] for line in lines], path)
+        loaded = time.perf_counter() - start
+    print('  cache hit (%d links): %8.1f ms' % (len(cached), loaded * 1000))
+
+    import dockerstub
+    records = dockerstub.synthetic_images(count)
+    with tempfile.TemporaryDirectory() as directory:
+        server = dockerstub.start(os.path.join(directory, 'docker.sock'), records)
+        client = DockerClient(server.server_address)
+        try:
+            start = time.perf_counter()
+            matched = list(main_api([records[-1]['Id'][7:19]], client))
+            api = time.perf_counter() - start
+        finally:
+            client.close()
+            server.shutdown()
+    print('  --socket end to end: %8.1f ms (%d lines matched)' % (api * 1000, len(matched)))
+
+
 if __name__ == '__main__':
-    print('\n'.join(main(sys.argv[1:])))
+    arg_parser = argparse.ArgumentParser(description="List Docker images dependent on one of the given image ids")
+    arg_parser.add_argument('images', nargs='*', help="image ids, possibly shortened")
+    arg_parser.add_argument('--socket', nargs='?', const=DOCKER_SOCKET, metavar='PATH',
+                            help="use the Docker Engine API on this unix socket (default %s)" % DOCKER_SOCKET)
+    arg_parser.add_argument('--cache', default=CACHE, metavar='PATH',
+                            help="file caching the image links (default %s)" % CACHE)
+    arg_parser.add_argument('--no-cache', dest='cache', action='store_const', const=None,
+                            help="inspect every image")
+    arg_parser.add_argument('--serve', action='store_true',
+                            help="answer JSON lines queries on stdin, or on the --listen socket, from a graph kept current")
+    arg_parser.add_argument('--listen', metavar='PATH',
+                            help="with --serve, the unix socket to answer queries on")
+    arg_parser.add_argument('--benchmark', type=int, metavar='COUNT',
+                            help="time the queries on a synthetic graph of COUNT images instead")
+    args = arg_parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+    elif args.serve:
+        daemon(args.socket, args.cache, args.listen)
+    else:
+        print('\n'.join(main(args.images, args.socket, args.cache)))
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+dockerstub: fake Docker Engine API on a unix socket
+
+Serves GET /_ping, /images/json (chunked, like dockerd), /images/{name}/json
+and /events from a list of image records, so that docker_dependent_images.py
+--socket can be tried and benchmarked without docker. add_image and
+delete_image change the images and send the matching events.
+"""
+
+import argparse
+import json
+import os
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler
+
+
+def synthetic_images(count, seed=None):
+    """
+    count image records as returned by /images/json, newest first. Each image
+    is built on a random older one, except one in a hundred which has no
+    parent. Images without children are tagged.
+    """
+    rand = random.Random(count if seed is None else seed)
+    image_ids = ['sha256:%064x' % rand.getrandbits(256) for _ in range(count)]
+    parents = ['' if number % 100 == 0 else image_ids[rand.randrange(number)] for number in range(count)]
+    has_children = set(parents)
+    images = [{'Id': image_id, 'ParentId': parent_id, 'Created': 1500000000 + number,
+               'RepoTags': ['<none>:<none>'] if image_id in has_children else ['repo%d:latest' % number],
+               'RepoDigests': [], 'Size': 1000 * number, 'Labels': None}
+              for number, (image_id, parent_id) in enumerate(zip(image_ids, parents))]
+    images.reverse()
+    return images
+
+
+class DockerHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/_ping':
+            self.send_text(200, 'OK')
+        elif path == '/images/json':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            images = self.server.images
+            for start in range(0, len(images), 100):
+                text = json.dumps(images[start:start + 100])
+                text = ('[' if start == 0 else ',') + text[1:-1]
+                self.send_chunk(text.encode('utf-8'))
+            self.send_chunk(b'[]' if not images else b']')
+            self.send_chunk(b'')
+        elif path == '/events':
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            position = 0
+            try:
+                while True:
+                    with self.server.changed:
+                        self.server.changed.wait_for(lambda: len(self.server.events) > position, timeout=1)
+                        events = self.server.events[position:]
+                    position += len(events)
+                    for event in events:
+                        self.send_chunk(json.dumps(event).encode('utf-8') + b'\n')
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+        elif path.startswith('/images/') and path.endswith('/json'):
+            record = self.server.find(urllib.parse.unquote(path[len('/images/'):-len('/json')]))
+            if record is None:
+                self.send_text(404, json.dumps({'message': 'No such image'}))
+            else:
+                self.send_text(200, json.dumps({'Id': record['Id'], 'Parent': record['ParentId'],
+                                                'RepoTags': [tag for tag in record['RepoTags'] if tag != '<none>:<none>']}))
+        else:
+            self.send_text(404, json.dumps({'message': 'page not found'}))
+
+    def send_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def send_text(self, code, text):
+        data = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionResetError:
+            #The client went away between two requests
+            pass
+
+    def address_string(self):
+        return 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def find(self, name):
+        for record in self.images:
+            if record['Id'] == name or record['Id'][len('sha256:'):].startswith(name.replace('sha256:', '')) \
+                    or name in record['RepoTags'] or name + ':latest' in record['RepoTags']:
+                return record
+        return None
+
+    def emit(self, action, name):
+        with self.changed:
+            self.events.append({'Type': 'image', 'Action': action, 'status': action, 'id': name,
+                                'Actor': {'ID': name, 'Attributes': {}}, 'time': int(time.time())})
+            self.changed.notify_all()
+
+    def add_image(self, record):
+        """
+        Add an image record, as a docker pull of its first tag would
+        """
+        self.images.insert(0, record)
+        self.emit('pull', record['RepoTags'][0] if record['RepoTags'] else record['Id'])
+
+    def delete_image(self, image_id):
+        record = self.find(image_id)
+        self.images.remove(record)
+        for tag in record['RepoTags']:
+            if tag != '<none>:<none>':
+                self.emit('untag', record['Id'])
+        self.emit('delete', record['Id'])
+
+
+def start(path, images):
+    """
+    Serve images on the unix socket path from a background thread, return the server.
+    """
+    if os.path.exists(path):
+        os.unlink(path)
+    server = DockerServer(path, DockerHandler)
+    server.images = images
+    server.events = []
+    server.changed = threading.Condition()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Fake Docker Engine API on a unix socket")
+    arg_parser.add_argument('--socket', default='/tmp/dockerstub.sock', help="path of the unix socket")
+    arg_parser.add_argument('--images', type=int, default=1000, help="number of synthetic images")
+    args = arg_parser.parse_args()
+
+    server = start(args.socket, synthetic_images(args.images))
+    print('Listening on %s' % args.socket)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        os.unlink(args.socket)
@@ -1,60 +1,101 @@
-import os
 import argparse
+import re
+import subprocess
 
-# define CLI args
-argparser = argparse.ArgumentParser(description='Takes a word as param, calculates the number of times this word was introducted in, or removed from the repo by every commiter.')
-argparser.add_argument('word', metavar='W', type=str, help='The word to search')
-argparser.add_argument('-i', '--case-insensitive', dest='ignore_case', action='store_true', default=False, help='Flag that the search should be case-insensitive')
+# Marks the commit headers in the git log output (written %x00 in the format), cannot appear in a diff line
+HEADER = '\x00'
 
-args = argparser.parse_args()
 
 
+""" raw log generator
 
-""" commit generator
-
-Takes a raw string using git log format, and for each commit, yields a dictionary
-whose structure is: {'author': $commit_author, 'diffs': commit_diffs}
+Runs a single `git log -p` limited to the commits changing the number of
+occurrences of word (git log -S), and yields its output lines as they come.
 """
-def getCommits(raw):
-    curAuthor = ''
-    curSha = ''
+def getRawLog(word, ignoreCase):
+    cmd = ['git', 'log', '--all', '-p', '--no-color', '--no-ext-diff', '--format=%x00%H %aN <%aE>', '-S', word]
+    if ignoreCase:
+        cmd.append('-i')
 
-    for line in raw:
-        if line[:7] == 'commit ':
-            curSha = line[7:]
-        elif line[:8] == 'Author: ':
-            curAuthor = line[8:]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding='utf-8', errors='replace')
+    try:
+        yield from process.stdout
+    finally:
+        process.stdout.close()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
 
-        if curSha and curAuthor:
-            commitContent = 4 # git diff curSĥa^ curSha
-            yield {'author': curAuthor, 'diffs': commitContent}
 
 
+""" commit generator
 
-""" get the raw logs from git for a list of words
+Takes the lines of the raw log, and for each commit, yields a dictionary
+whose structure is: {'sha': $commit_sha, 'author': $commit_author, 'added': $count, 'removed': $count}
+where the counts are the occurrences of word in the added and removed lines of its diff.
+Only the current commit is held in memory.
 """
-def getRawLogsForRegex(regex):
-    os.system('echo "" > /tmp/gitWordScorerResults')
-    for word in words:
-        os.system('git log -S "' + regex + '" --pickaxe-regex --source --all >> /tmp/gitwordscorerRawLog')
+def getCommits(raw, word, ignoreCase):
+    pattern = re.compile(re.escape(word), re.IGNORECASE if ignoreCase else 0)
+    countWord = lambda line: len(pattern.findall(line))
+    commit = None
+    inHunk = False
 
-    rawlog = open('/tmp/gitwordscorerRawLog', 'r')
+    for line in raw:
+        if line[:1] == HEADER:
+            if commit:
+                yield commit
+            sha, author = line[1:].rstrip('\n').split(' ', 1)
+            commit = {'sha': sha, 'author': author, 'added': 0, 'removed': 0}
+            inHunk = False
+        elif line[:5] == 'diff ':
+            # the file header lines (---, +++) come before the first hunk
+            inHunk = False
+        elif line[:2] == '@@':
+            inHunk = True
+        elif inHunk and line[:1] == '+':
+            commit['added'] += countWord(line[1:])
+        elif inHunk and line[:1] == '-':
+            commit['removed'] += countWord(line[1:])
+
+    if commit:
+        yield commit
+
+
+
+""" scores per author, in one pass over the commits
+
+Returns {$author: {'added': $count, 'removed': $count, 'commits': $count}}
+"""
+def getScores(commits):
+    scores = {}
+    for commit in commits:
+        score = scores.setdefault(commit['author'], {'added': 0, 'removed': 0, 'commits': 0})
+        score['added'] += commit['added']
+        score['removed'] += commit['removed']
+        score['commits'] += 1
+    return scores
 
-    content = rawlog.read()
-    rawlog.close()
-    os.system('rm /tmp/gitwordscorerRawLog')
 
-    return content
 
+def main():
+    # define CLI args
+    argparser = argparse.ArgumentParser(description='Takes a word as param, calculates the number of times this word was introducted in, or removed from the repo by every commiter.')
+    argparser.add_argument('word', metavar='W', type=str, help='The word to search')
+    argparser.add_argument('-i', '--case-insensitive', dest='ignore_case', action='store_true', default=False, help='Flag that the search should be case-insensitive')
 
+    args = argparser.parse_args()
 
-if __name__ == '__main__':
-    scores = {}
+    try:
+        scores = getScores(getCommits(getRawLog(args.word, args.ignore_case), args.word, args.ignore_case))
+    except subprocess.CalledProcessError as error:
+        # git already told why on stderr
+        raise SystemExit(error.returncode)
 
-    raw = getRawLogsForRegex(word + )
+    byNet = lambda item: (item[1]['added'] - item[1]['removed'], item[0])
+    for author, score in sorted(scores.items(), key=byNet, reverse=True):
+        print('%+6d  (+%d -%d in %d commits)  %s' % (score['added'] - score['removed'], score['added'], score['removed'], score['commits'], author))
 
-    for commit in getCommits(raw):
-        git diff COMMIT^ COMMIT
 
 
-    print('on a ' + str(len(raw)) + ' lignes de résultat')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+zendbench: benchmarks for zendclient.py
+
+Runs the client against the local emulator from zendstub.py and prints the
+results. No Zend Server is needed.
+"""
+
+import argparse
+import contextlib
+import hashlib
+import hmac
+import io
+import os
+import tempfile
+import time
+import zipfile
+
+import requests
+
+import zendstub
+from zendclient import Signer, Waiter, ZendApiError, ZendClient, ZpkPackage
+
+
+def rate(count, elapsed):
+	return count / elapsed if elapsed else float('inf')
+
+
+def bench_connection_pool(server, count):
+	"""
+	Compare calls/sec of the historical path (one requests.get per call, so one
+	TCP connection per call) against ZendClient's pooled keep-alive session.
+	"""
+	uri = '/ZendServer/Api/tasksComplete'
+
+	start = time.perf_counter()
+	for _ in range(count):
+		requests.get('http://' + server.target + uri).text
+	per_call = rate(count, time.perf_counter() - start)
+
+	client = ZendClient()
+	client.set_target({'host': server.target, 'key': 'admin', 'hash': 'secret'})
+	start = time.perf_counter()
+	for _ in range(count):
+		client.do_request(uri).text
+	pooled = rate(count, time.perf_counter() - start)
+	client.close()
+
+	print('connection pool: %d calls' % count)
+	print('  per-call connection: %8.1f calls/s' % per_call)
+	print('  pooled session:      %8.1f calls/s (x%.2f)' % (pooled, pooled / per_call))
+
+
+def write_zpk(directory, name, parameters):
+	"""
+	Write a synthetic ZPK whose descriptor has the given number of parameters,
+	half of them required and one in four restricted to an enum.
+	"""
+	xml = ['<package><name>%s</name><version><release>1.0.0</release></version><parameters>' % name]
+	for index in range(parameters):
+		xml.append('<parameter id="param%d" required="%s">' % (index, 'true' if index % 2 == 0 else 'false'))
+		if index % 4 == 0:
+			xml.append('<validation><enums><enum>a</enum><enum>b</enum><enum>c</enum></enums></validation>')
+		xml.append('<defaultvalue>a</defaultvalue></parameter>')
+	xml.append('</parameters></package>')
+	filename = os.path.join(directory, name + '.zpk')
+	with zipfile.ZipFile(filename, 'w') as archive:
+		archive.writestr('deployment.xml', ''.join(xml))
+	return filename
+
+
+def nested_scan_validate(package, configuration):
+	"""
+	The validation algorithm used before ZpkPackage.validate: one scan of the
+	configuration per parameter.
+	"""
+	is_valid = True
+	for parameter in package.parameters:
+		is_parameter_valid = False
+		if parameter['@required'] == 'true':
+			for config in configuration:
+				if config['name'] == parameter['@id'] and config['value'] != '':
+					if 'validation' in parameter:
+						if config['value'] in parameter['validation']['enums']['enum']:
+							is_parameter_valid = True
+					else:
+						is_parameter_valid = True
+		else:
+			is_parameter_valid = True
+		if not is_parameter_valid:
+			is_valid = False
+	return is_valid
+
+
+def bench_validation(parameters, count):
+	"""
+	Compare the nested-scan validation against ZpkPackage.validate on a
+	synthetic descriptor with the given number of parameters.
+	"""
+	with tempfile.TemporaryDirectory() as directory:
+		package = ZpkPackage.load(write_zpk(directory, 'bench', parameters))
+		configuration = [{'name': 'param%d' % index, 'value': 'a'} for index in range(parameters)]
+		package.validate(configuration)
+
+		start = time.perf_counter()
+		for _ in range(count):
+			nested_scan_validate(package, configuration)
+		nested = (time.perf_counter() - start) / count
+
+		start = time.perf_counter()
+		for _ in range(count):
+			package.validate(configuration)
+		indexed = (time.perf_counter() - start) / count
+
+	print('validation: %d parameters, %d runs' % (parameters, count))
+	print('  nested scan:   %10.3f ms/validation' % (nested * 1000))
+	print('  indexed:       %10.3f ms/validation (x%.1f)' % (indexed * 1000, nested / indexed))
+
+
+def legacy_headers(host, key, secret, useragent, uri):
+	"""
+	How do_request built the signed headers before Signer.
+	"""
+	timestamp = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+	data = host + ':' + uri.split('?')[0] + ':' + useragent + ':' + timestamp
+	signature = hmac.new(secret.encode('ascii'), data.encode('ascii'), hashlib.sha256).hexdigest()
+	return {'Date': timestamp, 'X-Zend-Signature': key + '; ' + signature}
+
+
+def bench_signing(count):
+	"""
+	Compare the per-request signing overhead before and after Signer.
+	"""
+	target = ('10.0.0.1:10081', 'admin', 'b7a3c5d8e1f2' * 5, 'zend_http_client')
+	uri = '/ZendServer/Api/applicationGetStatus?applications[]=42'
+
+	start = time.perf_counter()
+	for _ in range(count):
+		legacy_headers(*target, uri)
+	legacy = (time.perf_counter() - start) / count
+
+	signer = Signer(*target)
+	start = time.perf_counter()
+	for _ in range(count):
+		signer.headers(uri)
+	cached = (time.perf_counter() - start) / count
+
+	start = time.perf_counter()
+	for _ in range(count // 100):
+		signer.sign_batch([uri] * 100)
+	batch = (time.perf_counter() - start) / (count // 100 * 100)
+
+	print('signing: %d requests' % count)
+	print('  per-request hmac.new:  %8.2f us/request' % (legacy * 1e6))
+	print('  Signer.headers:        %8.2f us/request (x%.1f)' % (cached * 1e6, legacy / cached))
+	print('  Signer.sign_batch:     %8.2f us/request (x%.1f)' % (batch * 1e6, legacy / batch))
+
+
+def timed(function, *args):
+	"""
+	Run function with its output discarded, return the elapsed seconds, or None
+	when the call failed (non replayable calls are not retried on injected failures).
+	"""
+	start = time.perf_counter()
+	try:
+		with contextlib.redirect_stdout(io.StringIO()):
+			function(*args)
+	except ZendApiError:
+		return None
+	return time.perf_counter() - start
+
+
+def bench_end_to_end(size, latency, padding, failure_rate=0.0):
+	"""
+	Time the main client workflows against an emulator holding size
+	applications, vhosts and directives.
+	"""
+	server = zendstub.start(applications=size, vhosts=size, directives=size, extensions=size,
+	                        latency=latency, padding=padding, failure_rate=failure_rate)
+	client = ZendClient(waiter=Waiter(initial=0.01, max_interval=0.05), backoff_factor=0.01, retries=10)
+	client.set_target({'host': server.target, 'key': 'admin', 'hash': 'secret'})
+	try:
+		results = []
+		results.append(('get_applications_config', timed(client.get_applications_config)))
+		templates = {vhost['name']: [{'name': 'template', 'value': vhost['template'] + '\nServerAlias bench'}]
+		             for vhost in server.state.vhosts.values()}
+		results.append(('synchronize_vhost', timed(client.synchronize_vhost, templates)))
+		directives = [{'name': name, 'value': value + '0'} for name, value in server.state.directives.items()]
+		results.append(('synchronize_directives', timed(client.synchronize_directives, {'directives': directives})))
+		extensions = [{'name': name, 'value': 'false' if loaded == 'true' else 'true'}
+		              for name, loaded in server.state.extensions.items()]
+		results.append(('synchronize_extensions', timed(client.synchronize_extensions, {'extensions': extensions})))
+		with tempfile.TemporaryDirectory() as directory:
+			filename = write_zpk(directory, 'bench', size)
+			configuration = {'bench': [{'name': 'param%d' % index, 'value': 'a'} for index in range(size)]
+			                 + [{'name': 'metadata_baseurl', 'value': 'http://bench.example.com/'},
+			                    {'name': 'metadata_displayname', 'value': 'Bench'}]}
+			results.append(('deploy_or_update (deploy)', timed(client.deploy_or_update, filename, configuration)))
+			results.append(('deploy_or_update (update)', timed(client.deploy_or_update, filename, configuration)))
+		calls = sum(server.state.calls.values())
+	finally:
+		client.close()
+		server.shutdown()
+
+	print('end to end: %d items, %.0f ms latency, %.0f%% failures, %d API calls'
+	      % (size, latency * 1000, failure_rate * 100, calls))
+	for name, elapsed in results:
+		if elapsed is None:
+			print('  %-28s %13s' % (name + ':', 'failed'))
+		else:
+			print('  %-28s %10.1f ms' % (name + ':', elapsed * 1000))
+
+
+def bench_snapshot(size, latency):
+	"""
+	Time full and incremental snapshots against an emulator holding size
+	applications and vhosts, and check that a template edited behind the
+	client's back shows up as drift once the details are fetched again.
+	"""
+	server = zendstub.start(applications=size, vhosts=size, latency=latency)
+	client = ZendClient()
+	client.set_target({'host': server.target, 'key': 'admin', 'hash': 'secret'})
+	try:
+		start = time.perf_counter()
+		full = client.snapshot()
+		full_elapsed = time.perf_counter() - start
+		start = time.perf_counter()
+		client.snapshot(previous=full)
+		incremental_elapsed = time.perf_counter() - start
+
+		vhost = server.state.vhosts['1']
+		vhost['template'] += '\nServerAlias drift'
+		stale = client.snapshot(previous=full)
+		fresh = client.snapshot(previous=full, max_age=0)
+		current = client.get_vhost_config('1')
+	finally:
+		client.close()
+		server.shutdown()
+
+	if fresh['sections']['vhosts']['data'][vhost['name']] != current[vhost['name']]:
+		raise AssertionError('snapshot(max_age=0) missed the edited template of %s' % vhost['name'])
+	if stale['sections']['vhosts']['fetched'] != full['sections']['vhosts']['fetched']:
+		raise AssertionError('reused vhost details lost their fetch date')
+
+	print('snapshot: %d applications and vhosts, %.0f ms latency' % (size, latency * 1000))
+	print('  full:          %10.1f ms' % (full_elapsed * 1000))
+	print('  incremental:   %10.1f ms (x%.1f)' % (incremental_elapsed * 1000, full_elapsed / incremental_elapsed))
+	print('  edited template seen with max_age=0, reused details dated %s' % stale['sections']['vhosts']['fetched'])
+
+
+def main():
+	arg_parser = argparse.ArgumentParser(description="Benchmarks for zendclient.py")
+
+	arg_parser.add_argument('--count', dest='count', type=int, default=500,
+	                   help="number of calls per benchmark")
+	arg_parser.add_argument('--parameters', dest='parameters', type=int, default=500,
+	                   help="number of package parameters for the validation benchmark")
+	arg_parser.add_argument('--sizes', dest='sizes', default='10,100,1000',
+	                   help="comma separated numbers of items for the end to end benchmarks")
+	arg_parser.add_argument('--latency', dest='latency', type=float, default=0.0,
+	                   help="seconds of emulated latency per API call in the end to end benchmarks")
+	arg_parser.add_argument('--padding', dest='padding', type=int, default=0,
+	                   help="bytes of description added to every emulated directive")
+	arg_parser.add_argument('--failure-rate', dest='failure_rate', type=float, default=0.0,
+	                   help="probability for an emulated API call to fail with a 503")
+
+	args = arg_parser.parse_args()
+
+	server = zendstub.start()
+	try:
+		bench_connection_pool(server, args.count)
+	finally:
+		server.shutdown()
+	bench_validation(args.parameters, 20)
+	bench_signing(args.count * 100)
+	for size in args.sizes.split(','):
+		bench_end_to_end(int(size), args.latency, args.padding, args.failure_rate)
+	for size in args.sizes.split(','):
+		bench_snapshot(int(size), args.latency)
+
+
+if __name__ == '__main__':
+	main()
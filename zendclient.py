@@ -6,41 +6,895 @@ Doc: http://files.zend.com/help/Zend-Server/content/web_api_reference_guide.htm
 
 import requests
 import time
+import json
+import asyncio
+import functools
 import hmac
 import hashlib
+import zlib
 import xmltodict
+import xml.etree.ElementTree as ElementTree
 import zipfile
+import os
 import urllib.parse
-from requests_toolbelt.multipart.encoder import MultipartEncoder
+import threading
+import weakref
+import random
+import datetime
+from collections import OrderedDict, namedtuple
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+
+def local_name(tag):
+	return tag.rsplit('}',1)[-1]
+
+def element_to_dict(element):
+	"""
+	Convert an ElementTree element the way xmltodict does (namespaces stripped):
+	text-only elements become their text (None when empty), repeated children become lists.
+	"""
+	children = list(element)
+	text = element.text.strip() if element.text is not None and element.text.strip() else None
+	if not children and not element.attrib:
+		return text
+	result = {}
+	for name,value in element.attrib.items():
+		result['@'+local_name(name)] = value
+	for child in children:
+		name = local_name(child.tag)
+		value = element_to_dict(child)
+		if name not in result:
+			result[name] = value
+		elif type(result[name]) is list:
+			result[name].append(value)
+		else:
+			result[name] = [result[name],value]
+	if text is not None:
+		result['#text'] = text
+	return result
+
+def gzip_chunks(chunks,level=6):
+	"""
+	Gzip a stream of bytes chunks on the fly.
+	"""
+	compressor = zlib.compressobj(level,zlib.DEFLATED,31)
+	for chunk in chunks:
+		compressed = compressor.compress(chunk)
+		if compressed:
+			yield compressed
+	yield compressor.flush()
+
+def iter_xml_records(chunks,path):
+	"""
+	Incrementally parse an XML document and lazily yield, as dicts, the elements found at path.
+	Each record is discarded from the tree once yielded, so memory stays constant whatever
+	the number of records. Raises ValueError when the parent of the records is not in the
+	document (e.g. an errorData answer), which is not the same as an empty list.
+
+	:param chunks: Iterable of bytes, e.g. response.iter_content()
+	:param path: Tuple of element names from the root to the records, namespaces excluded
+
+	"""
+	parser = ElementTree.XMLPullParser(events=('start','end'))
+	depth = len(path)
+	stack = []
+	elements = []
+	found = False
+	for chunk in chunks:
+		parser.feed(chunk)
+		for event,element in parser.read_events():
+			if event == 'start':
+				stack.append(local_name(element.tag))
+				elements.append(element)
+				if len(stack) == depth-1 and tuple(stack) == path[:-1]:
+					found = True
+				continue
+			if len(stack) == depth and tuple(stack) == path:
+				yield element_to_dict(element)
+				elements[-2].remove(element)
+			stack.pop()
+			elements.pop()
+	parser.close()
+	if not found:
+		raise ValueError("No "+'/'.join(path[:-1])+" element in the document")
+
+
+class WaitTimeout(Exception):
+	"""
+	Raised when a Waiter deadline expires. pending holds what was still being waited for.
+	"""
+	def __init__(self,message,pending=None):
+		super().__init__(message)
+		self.pending = pending
+
+
+class WaitCancelled(Exception):
+	pass
+
+
+class ZendApiError(Exception):
+	"""
+	Raised by do_request when a Web API call fails. host and endpoint tell which one.
+	"""
+	def __init__(self,message,host=None,endpoint=None):
+		super().__init__(message)
+		self.host = host
+		self.endpoint = endpoint
+
+
+class ZendConnectionError(ZendApiError):
+	"""
+	The server could not be reached, or dropped the connection.
+	"""
+
+
+class ZendTimeout(ZendConnectionError):
+	"""
+	Connecting or waiting for the answer took longer than the configured timeout.
+	"""
+
+
+class ZendServerError(ZendApiError):
+	"""
+	The server kept answering 502/503/504. status holds the last one.
+	"""
+	def __init__(self,message,host=None,endpoint=None,status=None):
+		super().__init__(message,host,endpoint)
+		self.status = status
+
+
+class CircuitOpen(ZendApiError):
+	"""
+	Raised without calling the server: its circuit breaker is open after repeated failures.
+	"""
+
+
+class CircuitBreaker:
+	"""
+	Circuit breaker of one host. After threshold consecutive failed calls the circuit
+	opens and calls fail fast with CircuitOpen. Every reset_timeout seconds one trial
+	call is let through: success closes the circuit, failure keeps it open.
+	"""
+
+	def __init__(self,threshold=5,reset_timeout=30):
+		self.threshold = threshold
+		self.reset_timeout = reset_timeout
+		self.failures = 0
+		self.__opened = None
+		self.__lock = threading.Lock()
+
+	def __repr__(self):
+		return "CircuitBreaker(threshold=%r, reset_timeout=%r, state=%r)" % (self.threshold, self.reset_timeout, self.state)
+
+	@property
+	def state(self):
+		return 'closed' if self.__opened is None else 'open'
+
+	def allow(self):
+		with self.__lock:
+			if self.__opened is None:
+				return True
+			if time.monotonic()-self.__opened >= self.reset_timeout:
+				self.__opened = time.monotonic()
+				return True
+			return False
+
+	def success(self):
+		with self.__lock:
+			self.failures = 0
+			self.__opened = None
+
+	def failure(self):
+		with self.__lock:
+			self.failures += 1
+			if self.__opened is not None or self.failures >= self.threshold:
+				self.__opened = time.monotonic()
+
+
+class Waiter:
+	"""
+	Adaptive polling shared by every wait_* method.
+
+	The first probe is immediate, the next ones come after initial seconds, then the
+	interval grows by factor (with +/- jitter) up to max_interval. Waits give up with
+	WaitTimeout once timeout seconds are spent, and with WaitCancelled as soon as
+	cancel() is called (e.g. from another thread or a signal handler).
+	"""
+
+	def __init__(self,initial=0.25,factor=2,max_interval=5,jitter=0.2,timeout=1800):
+		self.initial = initial
+		self.factor = factor
+		self.max_interval = max_interval
+		self.jitter = jitter
+		self.timeout = timeout
+		self.__cancelled = threading.Event()
+
+	def __repr__(self):
+		return "Waiter(initial=%r, factor=%r, max_interval=%r, jitter=%r, timeout=%r)" % \
+					(self.initial, self.factor, self.max_interval, self.jitter, self.timeout)
+
+	def cancel(self):
+		self.__cancelled.set()
+
+	def reset(self):
+		self.__cancelled.clear()
+
+	def intervals(self):
+		interval = self.initial
+		while True:
+			yield interval*random.uniform(1-self.jitter,1+self.jitter)
+			interval = min(interval*self.factor,self.max_interval)
+
+	def wait(self,probe,done,timeout=None,on_poll=None):
+		"""
+		Call probe() until done(value) is true and return that last value.
+
+		:param probe: Function querying the current state
+		:param done: Function telling if the value returned by probe is final
+		:param timeout: Overrides the waiter timeout (seconds)
+		:param on_poll: Called with each value that is not final (progress display)
+
+		"""
+		return self.wait_many({None:(probe,done)},timeout=timeout,
+							  on_poll=(None if on_poll is None else lambda key,value: on_poll(value)))[None]
+
+	def wait_many(self,waits,timeout=None,on_poll=None):
+		"""
+		Wait for several things at once, in a single polling loop: every round probes all
+		the pending ones, then sleeps once. Probes may target different clients/nodes.
+
+		:param waits: Dict key => (probe, done), see wait
+		:param timeout: Overrides the waiter timeout (seconds)
+		:param on_poll: Called with (key, value) for each value that is not final
+		:return: Dict key => final value
+
+		"""
+		timeout = self.timeout if timeout is None else timeout
+		deadline = time.monotonic()+timeout
+		pending = dict(waits)
+		results = {}
+		intervals = self.intervals()
+		while True:
+			if self.__cancelled.is_set():
+				raise WaitCancelled()
+			for key,(probe,done) in list(pending.items()):
+				value = probe()
+				if done(value):
+					results[key] = value
+					del pending[key]
+				elif on_poll is not None:
+					on_poll(key,value)
+			if not pending:
+				return results
+			remaining = deadline-time.monotonic()
+			if remaining <= 0:
+				raise WaitTimeout("Still waiting after %ss" % (timeout,),list(pending))
+			if self.__cancelled.wait(min(next(intervals),remaining)):
+				raise WaitCancelled()
+
+
+class ResponseCache:
+	"""
+	LRU cache of parsed Web API answers, keyed by (host, uri, api version).
+
+	Only the endpoints listed in ttl are cached, each for its own number of seconds.
+	Cached answers are shared between callers and must not be modified.
+	"""
+
+	DEFAULT_TTL = {'applicationGetStatus': 10,
+				   'applicationGetDetails': 60,
+				   'vhostGetStatus': 10,
+				   'vhostGetDetails': 60,
+				   'configurationDirectivesList': 60,
+				   'configurationExtensionsList': 60,
+				   'jobqueueGetQueues': 60}
+
+	#Endpoints whose cached answers become stale when the key endpoint is called.
+	#Mutating endpoints not listed here invalidate everything cached for the host.
+	INVALIDATES = {'vhostEdit': ('vhostGetStatus','vhostGetDetails'),
+				   'vhostRedeploy': ('vhostGetStatus','vhostGetDetails'),
+				   'configurationStoreDirectives': ('configurationDirectivesList',),
+				   'configurationExtensionsOn': ('configurationExtensionsList','configurationDirectivesList'),
+				   'configurationExtensionsOff': ('configurationExtensionsList','configurationDirectivesList'),
+				   'restartPhp': ('applicationGetStatus','vhostGetStatus','configurationDirectivesList','configurationExtensionsList'),
+				   'restartDaemon': ('applicationGetStatus','vhostGetStatus','jobqueueGetQueues'),
+				   'jobqueueUpdateQueue': ('jobqueueGetQueues',),
+				   'applicationDeploy': ('applicationGetStatus','applicationGetDetails','vhostGetStatus','vhostGetDetails'),
+				   'applicationUpdate': ('applicationGetStatus','applicationGetDetails','vhostGetStatus','vhostGetDetails')}
+
+	def __init__(self,maxsize=256,ttl=None):
+		"""
+		:param maxsize: Maximum number of answers kept, the least recently used ones are evicted first
+		:param ttl: Dict endpoint name => seconds, merged over DEFAULT_TTL. A ttl of None disables caching for that endpoint
+
+		"""
+		self.maxsize = maxsize
+		self.ttl = dict(self.DEFAULT_TTL)
+		if ttl is not None:
+			self.ttl.update(ttl)
+		self.__entries = OrderedDict()
+		self.__lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.invalidations = 0
+
+	def __repr__(self):
+		return "ResponseCache(maxsize=%r, size=%r)" % (self.maxsize, len(self.__entries))
+
+	@staticmethod
+	def endpoint(uri):
+		return uri.split('?')[0].rsplit('/',1)[-1]
+
+	def is_cacheable(self,uri):
+		return self.ttl.get(self.endpoint(uri)) is not None
+
+	def get(self,key):
+		"""
+		Return (True, answer) on a fresh hit, (False, None) otherwise.
+		"""
+		with self.__lock:
+			entry = self.__entries.get(key)
+			if entry is not None and entry[0] > time.monotonic():
+				self.__entries.move_to_end(key)
+				self.hits += 1
+				return True,entry[1]
+			if entry is not None:
+				del self.__entries[key]
+			self.misses += 1
+			return False,None
+
+	def put(self,key,value):
+		ttl = self.ttl.get(self.endpoint(key[1]))
+		if ttl is None:
+			return
+		with self.__lock:
+			self.__entries[key] = (time.monotonic()+ttl,value)
+			self.__entries.move_to_end(key)
+			while len(self.__entries) > self.maxsize:
+				self.__entries.popitem(last=False)
+				self.evictions += 1
+
+	def invalidate(self,host,endpoints=None):
+		"""
+		Drop the answers cached for host. Only the given endpoint names when provided.
+		"""
+		with self.__lock:
+			for key in list(self.__entries):
+				if key[0] == host and (endpoints is None or self.endpoint(key[1]) in endpoints):
+					del self.__entries[key]
+					self.invalidations += 1
+
+	def invalidate_for(self,host,uri):
+		"""
+		Drop the answers made stale by a call to the (mutating) uri.
+		"""
+		self.invalidate(host,self.INVALIDATES.get(self.endpoint(uri)))
+
+	def clear(self):
+		with self.__lock:
+			self.__entries.clear()
+
+	def stats(self):
+		lookups = self.hits+self.misses
+		return {'hits':self.hits,
+				'misses':self.misses,
+				'hit_ratio':(self.hits/lookups if lookups else 0.0),
+				'evictions':self.evictions,
+				'invalidations':self.invalidations,
+				'size':len(self.__entries),
+				'maxsize':self.maxsize}
+
+
+class Application(namedtuple('Application','id packagename baseurl displayname version')):
+	"""
+	An application as listed by applicationGetStatus. version is a tuple of (deployed version, server id).
+	"""
+	__slots__ = ()
+
+	@classmethod
+	def from_record(cls,information):
+		servers = information['servers']['applicationServer']
+		servers = servers if type(servers) is list else [servers]
+		return cls(information['id'],information['appName'],information['baseUrl'],information['userAppName'],
+				   tuple((server['deployedVersion'],server['id']) for server in servers))
+
+	@property
+	def name(self):
+		return self.packagename
+
+
+class Vhost(namedtuple('Vhost','id baseurl status')):
+	"""
+	A vhost as listed by vhostGetStatus. status is a tuple of (server id, status).
+	"""
+	__slots__ = ()
+
+	@classmethod
+	def from_record(cls,information):
+		servers = information['servers']['vhostServer']
+		servers = servers if type(servers) is list else [servers]
+		return cls(information['id'],information['name'],tuple((server['id'],server['status']) for server in servers))
+
+	@property
+	def name(self):
+		return self.baseurl
+
+
+class Directive(namedtuple('Directive','name value')):
+	"""
+	A PHP directive, value being the file value or else the default one ('' when none).
+	"""
+	__slots__ = ()
+
+	@classmethod
+	def from_record(cls,directive):
+		value = directive['fileValue'] if directive['fileValue'] is not None else directive['defaultValue']
+		return cls(directive['name'],'' if value is None else value)
+
+
+class Extension(namedtuple('Extension','name value')):
+	"""
+	A PHP extension, value being 'true' when loaded.
+	"""
+	__slots__ = ()
+
+	@classmethod
+	def from_record(cls,extension):
+		return cls(extension['name'],extension['loaded'])
+
+
+class JobQueue(namedtuple('JobQueue','id name priority max_http_jobs max_wait_time http_connection_timeout http_job_timeout http_job_retry_count http_job_retry_timeout')):
+	"""
+	A job queue as listed by jobqueueGetQueues.
+	"""
+	__slots__ = ()
+
+	SETTINGS = ('priority','max_http_jobs','max_wait_time','http_connection_timeout','http_job_timeout','http_job_retry_count','http_job_retry_timeout')
+
+	@classmethod
+	def from_record(cls,queue):
+		return cls(*(queue.get(field) for field in cls._fields))
+
+	def settings(self):
+		"""
+		Dict of the settings, numbers as int.
+		"""
+		return {name:(int(value) if value is not None and value.isdigit() else value)
+				for name,value in zip(self.SETTINGS,(getattr(self,name) for name in self.SETTINGS))}
+
+	def changes(self,settings):
+		"""
+		Dict of the given settings that differ from this queue.
+
+		:param settings: Dict of settings as returned by settings(), or the same as a JSON string
+
+		"""
+		if isinstance(settings,str):
+			settings = json.loads(settings)
+		return {name:value for name,value in settings.items() if str(getattr(self,name,None)) != str(value)}
+
+
+def index_records(records):
+	"""
+	Dict name => record, for O(1) lookups by name.
+	"""
+	return {record.name:record for record in records}
+
+
+class Instrumentation:
+	"""
+	Instrumentation hooks called by ZendClient. This base class ignores everything:
+	subclass it, or use Metrics, and give the instance to ZendClient(instrumentation=...).
+	"""
+
+	def request(self,endpoint,method,duration,status,bytes_out,bytes_in,retries):
+		"""
+		Called after each Web API call, duration in seconds (retries included), status 0 when no answer was received.
+		"""
+
+	def parse(self,endpoint,duration):
+		"""
+		Called after parsing the answer of endpoint, duration in seconds.
+		"""
+
+	def wait(self,kind,duration):
+		"""
+		Called after polling for kind ('deployment', 'tasks', 'server') during duration seconds.
+		"""
+
+
+class Metrics(Instrumentation):
+	"""
+	Instrumentation recording, per endpoint, latency and parse time histograms, bytes
+	sent/received, retries and answers per status code, plus the time spent polling.
+	Exportable with to_json or to_prometheus.
+	"""
+
+	BUCKETS = (0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30)
+
+	def __init__(self,buckets=None):
+		self.buckets = self.BUCKETS if buckets is None else tuple(buckets)
+		self.__lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.__lock:
+			self.latency = {}
+			self.parse_time = {}
+			self.bytes_out = {}
+			self.bytes_in = {}
+			self.retries = {}
+			self.statuses = {}
+			self.wait_time = {}
+
+	def observe(self,histograms,endpoint,value):
+		histogram = histograms.get(endpoint)
+		if histogram is None:
+			histogram = histograms[endpoint] = {'count':0,'sum':0.0,'buckets':[0]*len(self.buckets)}
+		histogram['count'] += 1
+		histogram['sum'] += value
+		for index,bound in enumerate(self.buckets):
+			if value <= bound:
+				histogram['buckets'][index] += 1
+
+	def request(self,endpoint,method,duration,status,bytes_out,bytes_in,retries):
+		with self.__lock:
+			self.observe(self.latency,endpoint,duration)
+			self.bytes_out[endpoint] = self.bytes_out.get(endpoint,0)+bytes_out
+			self.bytes_in[endpoint] = self.bytes_in.get(endpoint,0)+bytes_in
+			self.retries[endpoint] = self.retries.get(endpoint,0)+retries
+			self.statuses[(endpoint,status)] = self.statuses.get((endpoint,status),0)+1
+
+	def parse(self,endpoint,duration):
+		with self.__lock:
+			self.observe(self.parse_time,endpoint,duration)
+
+	def wait(self,kind,duration):
+		with self.__lock:
+			self.wait_time[kind] = self.wait_time.get(kind,0.0)+duration
+
+	def as_dict(self):
+		with self.__lock:
+			endpoints = sorted(set(self.latency)|set(self.parse_time))
+			return {'buckets':list(self.buckets),
+					'endpoints':{endpoint:{'latency':self.latency.get(endpoint),
+										   'parse':self.parse_time.get(endpoint),
+										   'bytes_out':self.bytes_out.get(endpoint,0),
+										   'bytes_in':self.bytes_in.get(endpoint,0),
+										   'retries':self.retries.get(endpoint,0),
+										   'statuses':{str(status):count for (name,status),count in self.statuses.items() if name == endpoint}}
+								 for endpoint in endpoints},
+					'wait_time':dict(self.wait_time)}
+
+	def to_json(self,**kwargs):
+		return json.dumps(self.as_dict(),**kwargs)
+
+	def to_prometheus(self,prefix='zendclient'):
+		"""
+		Export the metrics in the Prometheus text exposition format.
+		"""
+		data = self.as_dict()
+		lines = []
+
+		def histogram(name,field,help):
+			lines.append('# HELP %s_%s %s' % (prefix,name,help))
+			lines.append('# TYPE %s_%s histogram' % (prefix,name))
+			for endpoint,metrics in sorted(data['endpoints'].items()):
+				if metrics[field] is None:
+					continue
+				for bound,count in zip(data['buckets'],metrics[field]['buckets']):
+					lines.append('%s_%s_bucket{endpoint="%s",le="%s"} %d' % (prefix,name,endpoint,bound,count))
+				lines.append('%s_%s_bucket{endpoint="%s",le="+Inf"} %d' % (prefix,name,endpoint,metrics[field]['count']))
+				lines.append('%s_%s_sum{endpoint="%s"} %f' % (prefix,name,endpoint,metrics[field]['sum']))
+				lines.append('%s_%s_count{endpoint="%s"} %d' % (prefix,name,endpoint,metrics[field]['count']))
+
+		def counter(name,field,help):
+			lines.append('# HELP %s_%s %s' % (prefix,name,help))
+			lines.append('# TYPE %s_%s counter' % (prefix,name))
+			for endpoint,metrics in sorted(data['endpoints'].items()):
+				lines.append('%s_%s{endpoint="%s"} %d' % (prefix,name,endpoint,metrics[field]))
+
+		histogram('request_duration_seconds','latency','Web API call latency')
+		histogram('parse_duration_seconds','parse','XML parse time of the answers')
+		counter('request_bytes_sent_total','bytes_out','Bytes sent')
+		counter('request_bytes_received_total','bytes_in','Bytes received')
+		counter('request_retries_total','retries','Retries done by do_request')
+		lines.append('# HELP %s_responses_total Answers per HTTP status' % (prefix,))
+		lines.append('# TYPE %s_responses_total counter' % (prefix,))
+		for endpoint,metrics in sorted(data['endpoints'].items()):
+			for status,count in sorted(metrics['statuses'].items()):
+				lines.append('%s_responses_total{endpoint="%s",status="%s"} %d' % (prefix,endpoint,status,count))
+		lines.append('# HELP %s_wait_seconds_total Time spent polling for completion' % (prefix,))
+		lines.append('# TYPE %s_wait_seconds_total counter' % (prefix,))
+		for kind,duration in sorted(data['wait_time'].items()):
+			lines.append('%s_wait_seconds_total{kind="%s"} %f' % (prefix,kind,duration))
+		return '\n'.join(lines)+'\n'
+
+
+class Signer:
+	"""
+	Signs Web API requests for one target, as described in the ZendApi documentation.
+
+	The keyed HMAC state and the constant parts of the signed string are computed once,
+	and the Date header once per second, so signing a request costs one HMAC copy/update.
+	"""
+
+	DATE_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
+
+	def __init__(self,host,key,secret,useragent):
+		self.host = host
+		self.key = key
+		self.useragent = useragent
+		self.__hmac = hmac.new(secret.encode('ascii'),digestmod=hashlib.sha256)
+		self.__prefix = (host+':').encode('ascii')
+		self.__suffix = (':'+useragent+':').encode('ascii')
+		self.__timestamp = (None,None)
+
+	def __repr__(self):
+		return "Signer(host=%r, key=%r, useragent=%r)" % (self.host, self.key, self.useragent)
+
+	def timestamp(self):
+		"""
+		The Date header value for the current second.
+		"""
+		now = int(time.time())
+		second,value = self.__timestamp
+		if second != now:
+			value = time.strftime(self.DATE_FORMAT,time.gmtime(now))
+			self.__timestamp = (now,value)
+		return value
+
+	def signature(self,uri,timestamp):
+		digest = self.__hmac.copy()
+		digest.update(self.__prefix+uri.split('?')[0].encode('ascii')+self.__suffix+timestamp.encode('ascii'))
+		return digest.hexdigest()
+
+	def headers(self,uri,timestamp=None):
+		"""
+		The Date and X-Zend-Signature headers of a request to uri.
+		"""
+		timestamp = self.timestamp() if timestamp is None else timestamp
+		return {'Date':timestamp,
+				'X-Zend-Signature':self.key+'; '+self.signature(uri,timestamp)}
+
+	def sign_batch(self,uris):
+		"""
+		Sign several uris with the same timestamp. Return a list of headers dicts, in order.
+		"""
+		timestamp = self.timestamp()
+		return [self.headers(uri,timestamp) for uri in uris]
+
+
+class ZpkPackage:
+	"""
+	A ZPK package, opened once.
+
+	deployment.xml is read when the package is opened (and the archive closed right away),
+	parsed on first use, and its parameters indexed by id. Use ZpkPackage.load to share
+	the parsed package between calls, as long as the file is not modified. Only the
+	MAX_PACKAGES most recently loaded packages are kept.
+	"""
+
+	MAX_PACKAGES = 16
+	__packages = OrderedDict()
+	__lock = threading.Lock()
+
+	def __init__(self,filename):
+		self.filename = filename
+		with zipfile.ZipFile(filename, 'r') as archive:
+			self.__xmldata = archive.read('deployment.xml')
+		self.__descriptor = None
+		self.__parameter_index = None
+		self.__required_rules = None
+
+	def __repr__(self):
+		return "ZpkPackage(filename=%r)" % (self.filename,)
+
+	@classmethod
+	def load(cls,filename):
+		"""
+		Return the package for filename, memoized by path, modification time and size.
+		"""
+		stat = os.stat(filename)
+		path = os.path.abspath(filename)
+		key = (stat.st_mtime_ns,stat.st_size)
+		with cls.__lock:
+			cached = cls.__packages.get(path)
+			if cached is not None and cached[0] == key:
+				cls.__packages.move_to_end(path)
+				return cached[1]
+		package = cls(filename)
+		with cls.__lock:
+			cls.__packages[path] = (key,package)
+			cls.__packages.move_to_end(path)
+			while len(cls.__packages) > cls.MAX_PACKAGES:
+				cls.__packages.popitem(last=False)
+		return package
+
+	@property
+	def descriptor(self):
+		if self.__descriptor is None:
+			self.__descriptor = xmltodict.parse(self.__xmldata)
+			self.__xmldata = None
+		return self.__descriptor
+
+	@property
+	def name(self):
+		return self.descriptor['package']['name']
+
+	@property
+	def version(self):
+		return self.descriptor['package']['version']['release']
+
+	@property
+	def parameters(self):
+		"""
+		The parameter elements of the descriptor, always as a list.
+		"""
+		if 'parameters' not in self.descriptor['package'] or self.descriptor['package']['parameters'] is None:
+			return []
+		parameters = self.descriptor['package']['parameters']['parameter']
+		return parameters if type(parameters) is list else [parameters]
+
+	@property
+	def parameter_index(self):
+		"""
+		Dict parameter id => {'required': bool, 'enums': frozenset of the allowed values or None, 'default': str}
+		"""
+		if self.__parameter_index is None:
+			index = {}
+			for parameter in self.parameters:
+				enums = None
+				validation = parameter.get('validation')
+				if validation is not None and validation.get('enums') is not None:
+					enums = validation['enums']['enum']
+					enums = frozenset(enums if type(enums) is list else [enums])
+				index[parameter['@id']] = {'required':parameter.get('@required') == 'true',
+										   'enums':enums,
+										   'default':('' if parameter.get('defaultvalue') is None else parameter['defaultvalue'])}
+			self.__parameter_index = index
+		return self.__parameter_index
+
+	def configuration(self):
+		"""
+		The package configuration pre-filled with the default values, as in get_package_configuration.
+		"""
+		return [{parameterid:parameter['default']} for parameterid,parameter in self.parameter_index.items()]
+
+	@property
+	def required_rules(self):
+		"""
+		(parameter id, enum set or None) of every required parameter, compiled once.
+		"""
+		if self.__required_rules is None:
+			self.__required_rules = [(parameterid,parameter['enums']) for parameterid,parameter in self.parameter_index.items() if parameter['required']]
+		return self.__required_rules
+
+	def validate(self,configuration):
+		"""
+		Check a package configuration (list of {'name','value'}) in linear time.
+
+		:return: List of {'parameter','reason'}, one per failing parameter. Empty when valid
+
+		"""
+		values = {}
+		for config in configuration:
+			if config['value'] != '':
+				values.setdefault(config['name'],set()).add(config['value'])
+
+		errors = []
+		for parameterid,enums in self.required_rules:
+			found = values.get(parameterid)
+			if not found:
+				errors.append({'parameter':parameterid,'reason':'required parameter is missing or empty'})
+			elif enums is not None and found.isdisjoint(enums):
+				errors.append({'parameter':parameterid,'reason':'value %s is not one of %s' % (', '.join(sorted(found)),', '.join(sorted(enums)))})
+		return errors
+
 
 class ZendClient:
+	api_version = '1.9'
 	xmlnamespace = {'zend': 'http://www.zend.com/server/deployment-descriptor/1.0',
 					'zendapi': 'http://www.zend.com/server/api/1.11'}
 
-	def __init__(self):
+	#jobqueueGetQueues field => jobqueueUpdateQueue parameter
+	JOBQUEUE_PARAMETERS = {'name':'name',
+						   'priority':'priority',
+						   'max_http_jobs':'maxHttpJobs',
+						   'max_wait_time':'maxWaitTime',
+						   'http_connection_timeout':'httpConnectionTimeout',
+						   'http_job_timeout':'httpJobTimeout',
+						   'http_job_retry_count':'httpJobRetryCount',
+						   'http_job_retry_timeout':'httpJobRetryTimeout'}
+
+	#POST endpoints setting a state, safe to send twice
+	IDEMPOTENT_ENDPOINTS = frozenset(['vhostEdit',
+									  'configurationStoreDirectives',
+									  'configurationExtensionsOn',
+									  'configurationExtensionsOff',
+									  'jobqueueUpdateQueue'])
+	RETRY_STATUSES = (502,503,504)
+
+	def __init__(self,pool_size=10,keep_alive=True,retries=3,backoff_factor=0.3,https=False,verify=True,max_workers=None,cache=False,waiter=None,
+				 upload_progress=None,upload_chunked=False,upload_gzip=False,upload_chunk_size=1024*1024,instrumentation=None,target=None,
+				 connect_timeout=10,read_timeout=120,breaker_threshold=5,breaker_reset=30):
+		"""
+		:param pool_size: Maximum number of connections kept open per host
+		:param keep_alive: Reuse connections between calls. When False, every request asks the server to close the connection
+		:param retries: Number of retries on connection errors, timeouts and 502/503/504 answers, for the calls safe to replay (see do_request)
+		:param backoff_factor: Retries wait backoff_factor*2**attempt seconds, or what Retry-After asks
+		:param https: Talk to the Web API over https instead of http
+		:param verify: Verify the server certificate when https is used (bool or path to a CA bundle)
+		:param max_workers: Number of threads used to fetch details in batch (defaults to pool_size)
+		:param cache: Cache the answers of read-only endpoints. True for a default ResponseCache, or a ResponseCache instance
+		:param waiter: Waiter used by all the wait_* methods (polling policy, deadline, cancellation)
+		:param upload_progress: Default upload callback, called with (bytes sent, total bytes, bytes/s)
+		:param upload_chunked: Send uploads with chunked transfer encoding
+		:param upload_gzip: Gzip uploads on the fly (Content-Encoding: gzip, implies chunked). The server or its proxy must support it
+		:param upload_chunk_size: Size of the chunks read from disk when uploads are chunked
+		:param instrumentation: Instrumentation (e.g. Metrics) notified of every call, parse and wait
+		:param target: Dict with host, key and hash. The client is then bound to that target: set_target is refused, which makes it safe to share between threads and coroutines
+		:param connect_timeout: Seconds to establish a connection (None waits forever)
+		:param read_timeout: Seconds to wait for the server between two bytes of the answer (None waits forever)
+		:param breaker_threshold: Consecutive failed calls after which a host circuit breaker opens (None disables the breakers)
+		:param breaker_reset: Seconds before an open circuit lets a trial call through
+
+		"""
 		print ('Debug: Init zendclient class')
 		self.__host = "127.0.0.1:10081"
 		self.__key = "admin"
 		self.__hash = "secret"
+		self.__bound = target is not None
+		if target is not None:
+			self.__host = target['host']
+			self.__key = target['key']
+			self.__hash = target['hash']
 		self.__useragent = "zend_http_client"
+		self.__signer = None
+		self.__pool_size = pool_size
+		self.__keep_alive = keep_alive
+		self.__retries = retries
+		self.__backoff_factor = backoff_factor
+		self.__scheme = 'https' if https else 'http'
+		self.__verify = verify
+		self.__connect_timeout = connect_timeout
+		self.__read_timeout = read_timeout
+		self.__breaker_threshold = breaker_threshold
+		self.__breaker_reset = breaker_reset
+		self.__breakers = {}
+		self.__sessions = {}
+		self.__sessions_lock = threading.Lock()
+		self.__max_workers = pool_size if max_workers is None else max_workers
+		self.__cache = ResponseCache() if cache is True else (cache or None)
+		self.waiter = Waiter() if waiter is None else waiter
+		self.__upload_progress = upload_progress
+		self.__upload_chunked = upload_chunked
+		self.__upload_gzip = upload_gzip
+		self.__upload_chunk_size = upload_chunk_size
+		self.instrumentation = Instrumentation() if instrumentation is None else instrumentation
 
 	def __repr__(self):
 		return "ZendClient(host=%r, key=%r, hash=%r, useragent=%r)" %   \
 					(self.__host, self.__key, self.__hash, self.__useragent)
 
 
-	def application_deploy(self,parameters=[]):
+	def application_deploy(self,parameters=[],progress=None):
 		"""
 		Allow to deploy a new package in the current ZendServer instance.
 		This function expect all the parameter to be set correctly as described in the Zend Documentation
 		and only act as a Wrapper. The data should be sent as a list object containing tuple.
+		The package is streamed from its file object, which the caller is responsible for closing.
 
 		:param parameters: List containing tuple of all the parameters required to deploy. See: http://files.zend.com/help/Zend-Server/content/the_applicationdeploy_method.htm for the complete list
+		:param progress: Upload callback, see ZendClient.__init__
 
 		"""
 		multipart_data = MultipartEncoder(parameters)
-		response = self.do_request("/ZendServer/Api/applicationDeploy",multipart_data=multipart_data)
-		return self.wait_for_deployment(xmltodict.parse(response.text))
+		response = self.do_request("/ZendServer/Api/applicationDeploy",multipart_data=multipart_data,progress=progress)
+		return self.wait_for_deployment(self.parse_response(response))
 
 	def get_package_metadata(self,filename):
 		"""
@@ -53,11 +907,8 @@ class ZendClient:
 		:param filename: The path to the ZPK file used to generate the configuration
 
 		"""
-		archive = zipfile.ZipFile(filename, 'r')
-		xmldata = archive.read('deployment.xml')
-
-		package_config=xmltodict.parse(xmldata)
-		return {'filename':filename,'packagename':package_config['package']['name'],'packageversion':package_config['package']['version']['release']}
+		package = ZpkPackage.load(filename)
+		return {'filename':filename,'packagename':package.name,'packageversion':package.version}
 
 	def get_package_configuration(self,filename):
 		"""
@@ -70,39 +921,45 @@ class ZendClient:
 		:param filename: The path to the ZPK file used to generate the configuration
 
 		"""
-		archive = zipfile.ZipFile(filename, 'r')
-		xmldata = archive.read('deployment.xml')
+		package = ZpkPackage.load(filename)
+		return {'package_name':package.name,'configuration':package.configuration()}
 
-		package_config=xmltodict.parse(xmldata)
 
-		if 'parameters' not in package_config['package'] or package_config['package']['parameters'] is None:
-			return {'package_name':package_config['package']['name'],'configuration':[]}
+	def jobqueue_get_queues(self):
+		return self.cached_request('/ZendServer/Api/jobqueueGetQueues')
 
-		configuration=[]
-		for parameter in package_config['package']['parameters']['parameter']:
-			configuration.append({parameter['@id']:('' if 'defaultvalue' not in parameter or parameter['defaultvalue'] is None else parameter['defaultvalue'])})
-		return {'package_name':package_config['package']['name'],'configuration':configuration}
+	def get_jobqueue_config(self):
+		"""
+		Return the job queues settings, each value being the dict of JobQueue.settings().
+		"""
+		return {'job_queues':[{'name':queue.name,'value':queue.settings()} for queue in self.jobqueue_records()]}
 
+	def synchronize_jobqueues(self,params):
+		if ('job_queues' not in params):
+			print ("No job queues provided")
+			return None
+		return self.reconcile({'job_queues':params['job_queues']})
 
-	def jobqueue_get_queues(self):
-		response = self.do_request('/ZendServer/Api/jobqueueGetQueues')
-		return xmltodict.parse(response.text)
+	@staticmethod
+	def jobqueue_changes(desired,current):
+		"""
+		Diff the desired job queues settings against the current ones.
+
+		:param desired: List of {'name','value'} as in get_jobqueue_config, value may also be a JSON string
+		:param current: Dict name => JobQueue
+		:return: List of {'id','name','settings'} with only the settings to change, one entry per queue
+
+		"""
+		changes = {}
+		for param in desired:
+			queue = current.get(param['name'])
+			if queue is None:
+				continue
+			settings = queue.changes(param['value'])
+			if settings:
+				changes.setdefault(queue.name,{'id':queue.id,'name':queue.name,'settings':{}})['settings'].update(settings)
+		return list(changes.values())
 
-	def get_jobqueue_config(self):
-		configuration={'job_queues':[]}
-		for queue in self.jobqueue_get_queues()['zendServerAPIResponse']['responseData']['queues']['queue']:
-			queueconfig = '{'
-			queueconfig+='"priority":'+queue['priority']
-			queueconfig+=',"max_http_jobs":'+queue['max_http_jobs']
-			queueconfig+=',"max_wait_time":'+queue['max_wait_time']
-			queueconfig+=',"http_connection_timeout":'+queue['http_connection_timeout']
-			queueconfig+=',"http_job_timeout":'+queue['http_job_timeout']
-			queueconfig+=',"http_job_retry_count":'+queue['http_job_retry_count']
-			queueconfig+=',"http_job_retry_timeout":'+queue['http_job_retry_timeout']
-			queueconfig+='}'
-			configuration['job_queues'].append({'name':queue['name'],'value':queueconfig})
-		return configuration
-		
 	def generate_signature(self,uri,timestamp):
 		"""
 		Generate signature as described in ZendApi documentation
@@ -111,34 +968,324 @@ class ZendClient:
 		:param timestamp: timestamp that will be used in the request..
 
 		"""
-		data=self.__host+':'+uri.split('?')[0]+':'+self.__useragent+':'+timestamp
-		return hmac.new(self.__hash.encode('ascii'), data.encode('ascii'), hashlib.sha256).hexdigest()
+		return self.get_signer().signature(uri,timestamp)
+
+	def get_signer(self):
+		"""
+		Return the Signer of the current target, built once per target.
+		"""
+		signer = self.__signer
+		if signer is None or (signer.host,signer.key) != (self.__host,self.__key):
+			signer = self.__signer = Signer(self.__host,self.__key,self.__hash,self.__useragent)
+		return signer
+
+	@property
+	def host(self):
+		return self.__host
+
+	def get_target(self):
+		"""
+		Return the current target as a dict with host, key and hash, as given to set_target.
+		"""
+		return {'host':self.__host,'key':self.__key,'hash':self.__hash}
 
 	def set_target(self,data):
+		if self.__bound:
+			raise RuntimeError("This client is bound to %s, use one client per target (see ZendRegistry)" % (self.__host,))
 		self.__host=data['host']
 		self.__key=data['key']
 		self.__hash=data['hash']
+		self.__signer=None
+
+	def get_session(self,host=None):
+		"""
+		Return the pooled session used to talk to the given host (current target by default).
+		Sessions are created on first use and kept for the lifetime of the client, so every
+		endpoint method shares the same keep-alive connections.
+
+		:param host: host:port of the Zend Server
+
+		"""
+		host = self.__host if host is None else host
+		session = self.__sessions.get(host)
+		if session is not None:
+			return session
+		with self.__sessions_lock:
+			if host in self.__sessions:
+				return self.__sessions[host]
+			#Retries are done by do_request, which knows which calls are safe to replay
+			adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.__pool_size, max_retries=0)
+			session = requests.Session()
+			session.mount(self.__scheme+'://', adapter)
+			session.verify = self.__verify
+			if not self.__keep_alive:
+				session.headers['Connection'] = 'close'
+			self.__sessions[host] = session
+		return session
+
+	def get_breaker(self,host=None):
+		"""
+		Return the CircuitBreaker of the given host (current target by default), None when disabled.
+		"""
+		if self.__breaker_threshold is None:
+			return None
+		host = self.__host if host is None else host
+		with self.__sessions_lock:
+			breaker = self.__breakers.get(host)
+			if breaker is None:
+				breaker = self.__breakers[host] = CircuitBreaker(self.__breaker_threshold,self.__breaker_reset)
+		return breaker
+
+	def close(self):
+		"""
+		Close every pooled connection opened by this client.
+		"""
+		for session in self.__sessions.values():
+			session.close()
+		self.__sessions = {}
 
-	def do_request(self,uri,data=None,multipart_data=None, files=None):
-		timestamp = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
-		headers= {'Date': timestamp,
-				  'User-agent': self.__useragent,
-				  'X-Zend-Signature': self.__key+'; '+ self.generate_signature(uri,timestamp),
-				  'Accept':'application/vnd.zend.serverapi+xml;version=1.9'}
-
-		if files is not None:
-			response = requests.post('http://'+self.__host+uri, files=files, headers=headers)
-		elif multipart_data is not None:
-			headers['Content-Type']= multipart_data.content_type
-			response = requests.post('http://'+self.__host+uri, data=multipart_data,headers=headers)
-		elif data is not None:
-			response = requests.post('http://'+self.__host+uri, data=data,headers=headers)
+	def multipart_body(self,multipart_data,progress=None):
+		"""
+		Return (body, headers, sent) to stream a MultipartEncoder from disk: reports the upload
+		progress, and sends it chunked and/or gzipped when configured. sent() returns the
+		number of bytes of the body sent so far.
+		"""
+		progress = self.__upload_progress if progress is None else progress
+		if progress is not None:
+			start = time.monotonic()
+			total = multipart_data.len
+
+			def callback(monitor):
+				elapsed = time.monotonic()-start
+				progress(monitor.bytes_read,total,(monitor.bytes_read/elapsed if elapsed else 0.0))
+			multipart_data = MultipartEncoderMonitor(multipart_data,callback)
+
+		headers = {'Content-Type':multipart_data.content_type}
+		if not (self.__upload_chunked or self.__upload_gzip):
+			return multipart_data,headers,lambda: multipart_data.len
+
+		chunks = iter(functools.partial(multipart_data.read,self.__upload_chunk_size),b'')
+		if self.__upload_gzip:
+			headers['Content-Encoding'] = 'gzip'
+			chunks = gzip_chunks(chunks)
+		sent = [0]
+
+		def counted(chunks):
+			for chunk in chunks:
+				sent[0] += len(chunk)
+				yield chunk
+		return counted(chunks),headers,lambda: sent[0]
+
+	def do_request(self,uri,data=None,multipart_data=None, files=None, stream=False, progress=None):
+		"""
+		Sign and send a Web API call: POST when data, multipart_data or files is given, GET otherwise.
+
+		Connection errors, timeouts and 502/503/504 answers are retried with backoff when the
+		call is safe to replay: GETs, POSTs to IDEMPOTENT_ENDPOINTS, and any form POST whose
+		connection could not even be established. Uploads are never replayed. When retries are
+		exhausted, ZendTimeout, ZendConnectionError or ZendServerError is raised and counts as a
+		failure for the host circuit breaker. While it is open, calls fail at once with CircuitOpen.
+		"""
+		endpoint = ResponseCache.endpoint(uri)
+		breaker = self.get_breaker()
+		if breaker is not None and not breaker.allow():
+			raise CircuitOpen("Circuit breaker open for "+self.__host+", "+endpoint+" not called",self.__host,endpoint)
+		replayable = files is None and multipart_data is None
+		idempotent = replayable and (data is None or endpoint in self.IDEMPOTENT_ENDPOINTS)
+		method = 'GET' if replayable and data is None else 'POST'
+
+		session = self.get_session()
+		url = self.__scheme+'://'+self.__host+uri
+		timeout = (self.__connect_timeout,self.__read_timeout)
+		attempt = 0
+		sent = None
+		start = time.perf_counter()
+		while True:
+			headers = self.get_signer().headers(uri)
+			headers['User-agent'] = self.__useragent
+			headers['Accept'] = 'application/vnd.zend.serverapi+xml;version='+self.api_version
+			try:
+				if files is not None:
+					response = session.post(url, files=files, headers=headers, timeout=timeout)
+				elif multipart_data is not None:
+					body,upload_headers,sent = self.multipart_body(multipart_data,progress)
+					headers.update(upload_headers)
+					response = session.post(url, data=body,headers=headers, timeout=timeout)
+				elif data is not None:
+					response = session.post(url, data=data,headers=headers, timeout=timeout)
+				else:
+					response = session.get(url,headers=headers,stream=stream, timeout=timeout)
+			except requests.exceptions.RequestException as exception:
+				if attempt < self.__retries and (idempotent or (replayable and self.connection_refused(exception))):
+					self.backoff(attempt)
+					attempt += 1
+					continue
+				self.instrumentation.request(endpoint,method,time.perf_counter()-start,0,(0 if sent is None else sent()),0,attempt)
+				if breaker is not None:
+					breaker.failure()
+				raise self.classify_error(exception,endpoint) from exception
+			if response.status_code in self.RETRY_STATUSES and idempotent and attempt < self.__retries:
+				response.close()
+				self.backoff(attempt,response.headers.get('Retry-After'))
+				attempt += 1
+				continue
+			break
+		duration = time.perf_counter()-start
+
+		bytes_out = sent() if sent is not None else int(response.request.headers.get('Content-Length',0))
+		report = functools.partial(self.instrumentation.request,endpoint,method,duration,response.status_code,bytes_out)
+		if stream:
+			#The reader reports the call once the answer is consumed: report_received(bytes received)
+			response.report_received = lambda received: report(received,attempt)
 		else:
-			response = requests.get('http://'+self.__host+uri,headers=headers)
+			report(len(response.content),attempt)
+		if response.status_code in self.RETRY_STATUSES:
+			if breaker is not None:
+				breaker.failure()
+			if stream:
+				#Nobody will read the answer: report it and give the connection back to the pool
+				response.report_received(0)
+				response.close()
+			raise ZendServerError(self.__host+" answered "+str(response.status_code)+" to "+endpoint,self.__host,endpoint,response.status_code)
+		if breaker is not None:
+			breaker.success()
+		if self.__cache is not None and (files is not None or multipart_data is not None or data is not None):
+			self.__cache.invalidate_for(self.__host,uri)
 		return response
 
+	@staticmethod
+	def connection_refused(exception):
+		"""
+		Tell if the request failed before the connection was established, so it never reached the server.
+		"""
+		if isinstance(exception,requests.exceptions.ConnectTimeout):
+			return True
+		reason = getattr(exception.args[0],'reason',None) if exception.args else None
+		return isinstance(exception,requests.exceptions.ConnectionError) and isinstance(reason,NewConnectionError)
+
+	def classify_error(self,exception,endpoint):
+		"""
+		Turn a requests exception into the matching ZendApiError.
+		"""
+		if isinstance(exception,requests.exceptions.Timeout):
+			return ZendTimeout("Timeout calling "+endpoint+" on "+self.__host+": "+str(exception),self.__host,endpoint)
+		if isinstance(exception,(requests.exceptions.ConnectionError,requests.exceptions.ChunkedEncodingError)):
+			return ZendConnectionError("Cannot reach "+self.__host+" for "+endpoint+": "+str(exception),self.__host,endpoint)
+		return ZendApiError("Calling "+endpoint+" on "+self.__host+" failed: "+str(exception),self.__host,endpoint)
+
+	def backoff(self,attempt,retry_after=None):
+		delay = self.__backoff_factor*(2**attempt)
+		if retry_after is not None and retry_after.isdigit():
+			delay = max(delay,int(retry_after))
+		time.sleep(delay)
+
+	def cached_request(self,uri,parse=None,use_cache=True):
+		"""
+		GET uri and return the parsed answer, served from the response cache when enabled.
+
+		:param uri: Zend url, without the host
+		:param parse: Function turning the response in a parsed answer (parse_response by default)
+		:param use_cache: False to always hit the server (the fresh answer is still stored)
 
-	def lib_version_deploy(self, name, path):
+		"""
+		key = (self.__host,uri,self.api_version)
+		if self.__cache is not None and use_cache and self.__cache.is_cacheable(uri):
+			found,value = self.__cache.get(key)
+			if found:
+				return value
+
+		response = self.do_request(uri)
+		value = self.parse_response(response) if parse is None else parse(response)
+		if self.__cache is not None:
+			self.__cache.put(key,value)
+		return value
+
+	def stream_records(self,uri,path):
+		"""
+		GET uri and lazily yield the records found at path (see iter_xml_records) while the
+		answer is downloaded, without building the whole document in memory.
+		When the response cache is enabled, the records are collected and cached instead.
+
+		:param uri: Zend url, without the host
+		:param path: Tuple of element names from zendServerAPIResponse to the records
+
+		"""
+		key = (self.__host,uri,self.api_version,path)
+		if self.__cache is not None and self.__cache.is_cacheable(uri):
+			found,records = self.__cache.get(key)
+			if not found:
+				records = list(self.stream_records_uncached(uri,path))
+				self.__cache.put(key,records)
+			return iter(records)
+		return self.stream_records_uncached(uri,path)
+
+	def stream_records_uncached(self,uri,path):
+		endpoint = ResponseCache.endpoint(uri)
+		response = self.do_request(uri,stream=True)
+		if not response.ok:
+			try:
+				raise ZendApiError(self.__host+" answered "+str(response.status_code)+" to "+endpoint+": "+self.error_message(response.content),
+								   self.__host,endpoint)
+			finally:
+				response.report_received(len(response.content))
+				response.close()
+		received = [0]
+
+		def counted(chunks):
+			for chunk in chunks:
+				received[0] += len(chunk)
+				yield chunk
+		#Parse time includes the download, both are interleaved
+		start = time.perf_counter()
+		try:
+			yield from iter_xml_records(counted(response.iter_content(chunk_size=65536)),path)
+		except (ValueError,ElementTree.ParseError) as error:
+			raise ZendApiError("Unexpected answer from "+self.__host+" to "+endpoint+": "+str(error),self.__host,endpoint) from error
+		finally:
+			response.report_received(received[0])
+			response.close()
+			self.instrumentation.parse(ResponseCache.endpoint(uri),time.perf_counter()-start)
+
+	@staticmethod
+	def error_message(content):
+		"""
+		errorCode and errorMessage of an errorData answer, or its beginning when it is not one.
+		"""
+		try:
+			root = ElementTree.fromstring(content)
+		except ElementTree.ParseError:
+			return content[:200].decode('utf-8','replace')
+		fields = {local_name(element.tag):(element.text or '').strip() for element in root.iter()}
+		return ' '.join(filter(None,(fields.get('errorCode'),fields.get('errorMessage'))))
+
+	def parse_response(self,response,escape_ampersands=False):
+		"""
+		Parse a Web API answer, reporting the parse time to the instrumentation.
+
+		:param escape_ampersands: Escape the raw '&' some answers contain (applicationGetDetails)
+
+		"""
+		start = time.perf_counter()
+		text = response.text.replace("&","&amp;") if escape_ampersands else response.text
+		parsed = xmltodict.parse(text)
+		self.instrumentation.parse(ResponseCache.endpoint(response.request.path_url),time.perf_counter()-start)
+		return parsed
+
+	def cache_stats(self):
+		"""
+		Return the response cache hit/miss statistics, or None when the cache is disabled.
+		"""
+		return None if self.__cache is None else self.__cache.stats()
+
+	def invalidate_cache(self,endpoints=None):
+		"""
+		Drop the cached answers of the current target, only for the given endpoint names when provided.
+		"""
+		if self.__cache is not None:
+			self.__cache.invalidate(self.__host,endpoints)
+
+
+	def lib_version_deploy(self, name, path, progress=None):
 		"""
 		Deploy a new library version to the server or cluster. 
 		This process is asynchronous – the initial request will wait until the
@@ -151,12 +1298,12 @@ class ZendClient:
 
 		http://files.zend.com/help/Zend-Server/content/the_libraryversiondeploy_method.htm
 		"""
-		lib_file_param = {
-			'libPackage': (name, open(path+name, 'rb').read(), 'library/vnd.zend.librarypackage')
-		}
-		
-		response = self.do_request("/ZendServer/Api/libraryVersionDeploy", files=lib_file_param)
-		return xmltodict.parse(response.text)
+		with open(path+name, 'rb') as package:
+			multipart_data = MultipartEncoder({
+				'libPackage': (name, package, 'library/vnd.zend.librarypackage')
+			})
+			response = self.do_request("/ZendServer/Api/libraryVersionDeploy", multipart_data=multipart_data, progress=progress)
+		return self.parse_response(response)
 
 	def lib_version_synchronize(self, lib_version_id):
 		"""
@@ -171,7 +1318,7 @@ class ZendClient:
 			libraryVersionId: lib_version_id
 		}
 		response = self.do_request("/ZendServer/Api/libraryVersionSynchronize", data=data)
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 	def lib_version_get_status(self, lib_version_id):
 		"""
@@ -181,7 +1328,7 @@ class ZendClient:
 		http://files.zend.com/help/Zend-Server/content/the_libraryversiongetstatus_method.htm
 		"""
 		response = self.do_request("/ZendServer/Api/libraryVersionGetStatus?libraryVersionId="+lib_version_id)
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 
 	def lib_get_status(self, libraries=None, direction=None):
@@ -204,46 +1351,50 @@ class ZendClient:
 			query_params.append("direction=%s" % (direction,))
 
 		response = self.do_request("/ZendServer/Api/libraryGetStatus?" + "&".join(query_params))
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 
 
-	def application_get_status(self,applicationid=None):
-		response = self.do_request('/ZendServer/Api/applicationGetStatus'+('?applications[]='+str(applicationid) if applicationid is not None else ''))
-		return xmltodict.parse(response.text)
+	def application_get_status(self,applicationid=None,use_cache=True):
+		return self.cached_request('/ZendServer/Api/applicationGetStatus'+('?applications[]='+str(applicationid) if applicationid is not None else ''),use_cache=use_cache)
 
 
 	#Retrieve in a prettier way the application getStatus
+	def application_records(self):
+		"""
+		Return the applications as Application records, built while the answer is parsed.
+		"""
+		return [Application.from_record(information) for information in self.stream_records('/ZendServer/Api/applicationGetStatus',
+																							 ('zendServerAPIResponse','responseData','applicationsList','applicationInfo'))]
+
 	def get_application_list(self):
 		applicationlist = []
-		response = self.application_get_status()
-		if (response['zendServerAPIResponse']['responseData']['applicationsList'] is None):
-			return []
-		application_info = response['zendServerAPIResponse']['responseData']['applicationsList']['applicationInfo']
-		if (type(application_info) is not list):
-			application_info=[application_info]
-		for information in application_info:
-			version=[]
-			application_server=information['servers']['applicationServer']
-			if (type(application_server) is not list):
-				application_server=[application_server]
-			for servers in application_server:
-				version.append({'version':servers['deployedVersion'],'server':servers['id']})
-			applicationlist.append({'id':information['id'],
-									'packagename':information['appName'],
-									'baseurl':information['baseUrl'],
-									'displayname':information['userAppName'],
-									'version':version})
+		for application in self.application_records():
+			applicationlist.append({'id':application.id,
+									'packagename':application.packagename,
+									'baseurl':application.baseurl,
+									'displayname':application.displayname,
+									'version':[{'version':version,'server':server} for version,server in application.version]})
 
 		return applicationlist
 
 	def application_get_details(self,applicationid):
-		response = self.do_request("/ZendServer/Api/applicationGetDetails?application="+str(applicationid))
-		return xmltodict.parse(response.text.replace("&","&amp;"))
+		return self.cached_request("/ZendServer/Api/applicationGetDetails?application="+str(applicationid),
+								   parse=lambda response: self.parse_response(response,escape_ampersands=True))
+
 
+	def fetch_all(self,function,items):
+		"""
+		Call function once per item, concurrently through a thread pool of max_workers
+		threads sharing the connection pool, and return the results in the items order.
+		"""
+		items = list(items)
+		if len(items) <= 1 or self.__max_workers <= 1:
+			return [function(item) for item in items]
+		with ThreadPoolExecutor(max_workers=min(self.__max_workers,len(items))) as executor:
+			return list(executor.map(function,items))
 
 	def get_applications_config(self,applicationid=None):
-		configuration={}
 		applicationlist=[]
 
 		if (applicationid is None):
@@ -252,43 +1403,54 @@ class ZendClient:
 		else:
 			applicationlist.append(applicationid)
 
-		for application in applicationlist:
-			response = self.application_get_details(application)
-			packagename=response['zendServerAPIResponse']['responseData']['applicationDetails']['applicationInfo']['appName']
-			configuration[packagename]=[]
+		return self.get_applications_details_config(applicationlist)
 
-			if response['zendServerAPIResponse']['responseData']['applicationDetails']['applicationPackage']['userParams'] is not None:
-				for information in response['zendServerAPIResponse']['responseData']['applicationDetails']['applicationPackage']['userParams']['parameter']:
-					configuration[packagename].append({'name':information['name'],'value':( '' if information['value'] is None else information['value'] )})
-			configuration[packagename].append({'name':'metadata_baseurl','value':response['zendServerAPIResponse']['responseData']['applicationDetails']['applicationInfo']['baseUrl']})
-			configuration[packagename].append({'name':'metadata_displayname','value':response['zendServerAPIResponse']['responseData']['applicationDetails']['applicationInfo']['userAppName']})
+	def get_applications_details_config(self,applicationlist):
+		"""
+		Fetch the details of all the given application ids in one batch.
+		Return the same structure as get_applications_config.
+		"""
+		configuration={}
+		for response in self.fetch_all(self.application_get_details,applicationlist):
+			packagename,parameters = self.parse_application_details(response)
+			configuration[packagename]=parameters
 		return configuration
 
+	@staticmethod
+	def parse_application_details(response):
+		"""
+		Turn an applicationGetDetails answer into (package name, configuration list).
+		"""
+		details=response['zendServerAPIResponse']['responseData']['applicationDetails']
+		configuration=[]
+		if details['applicationPackage']['userParams'] is not None:
+			for information in details['applicationPackage']['userParams']['parameter']:
+				configuration.append({'name':information['name'],'value':( '' if information['value'] is None else information['value'] )})
+		configuration.append({'name':'metadata_baseurl','value':details['applicationInfo']['baseUrl']})
+		configuration.append({'name':'metadata_displayname','value':details['applicationInfo']['userAppName']})
+		return details['applicationInfo']['appName'],configuration
+
 
 	def vhost_get_status(self):
-		response = self.do_request("/ZendServer/Api/vhostGetStatus")
-		return (xmltodict.parse(response.text))
+		return self.cached_request("/ZendServer/Api/vhostGetStatus")
+
+	def vhost_records(self):
+		"""
+		Return the vhosts as Vhost records, built while the answer is parsed.
+		"""
+		return [Vhost.from_record(information) for information in self.stream_records('/ZendServer/Api/vhostGetStatus',
+																					   ('zendServerAPIResponse','responseData','vhostList','vhostInfo'))]
 
 	def get_vhost_list(self):
 		vhostlist=[]
-
-		response = self.vhost_get_status()
-		for information in response['zendServerAPIResponse']['responseData']['vhostList']['vhostInfo']:
-			status=[]
-			if (type(information['servers']['vhostServer']) == list):
-				for servers in information['servers']['vhostServer']:
-					status.append({'id':servers['id'],'status':servers['status']})
-			else:
-				status.append({'id':information['servers']['vhostServer']['id'],'status':information['servers']['vhostServer']['status']})
-			vhostlist.append({'id':information['id'],'baseurl':information['name'],'status':status})
+		for vhost in self.vhost_records():
+			vhostlist.append({'id':vhost.id,'baseurl':vhost.baseurl,'status':[{'id':server,'status':status} for server,status in vhost.status]})
 		return vhostlist
 
 	def vhost_get_details(self,vhostid):
-		response = self.do_request("/ZendServer/Api/vhostGetDetails?vhost="+str(vhostid))
-		return (xmltodict.parse(response.text))
+		return self.cached_request("/ZendServer/Api/vhostGetDetails?vhost="+str(vhostid))
 
 	def get_vhost_config(self,vhostid=None):
-		configuration={}
 		vhostlist=[]
 
 		if (vhostid is None):
@@ -297,65 +1459,64 @@ class ZendClient:
 		else:
 			vhostlist.append(vhostid)
 
-		for vhost in vhostlist:
-			response = self.vhost_get_details(vhost)
-			vhostname=response['zendServerAPIResponse']['responseData']['vhostDetails']['vhostInfo']['name']
-			configuration[vhostname]=[{'name': 'template','value':('' if response['zendServerAPIResponse']['responseData']['vhostDetails']['vhostExtended']['template'] is None else response['zendServerAPIResponse']['responseData']['vhostDetails']['vhostExtended']['template'])}]
+		return self.get_vhosts_details_config(vhostlist)
+
+	def get_vhosts_details_config(self,vhostlist):
+		"""
+		Fetch the details of all the given vhost ids in one batch.
+		Return the same structure as get_vhost_config.
+		"""
+		configuration={}
+		for response in self.fetch_all(self.vhost_get_details,vhostlist):
+			vhostname,template = self.parse_vhost_details(response)
+			configuration[vhostname]=template
 		return configuration
 
+	@staticmethod
+	def parse_vhost_details(response):
+		"""
+		Turn a vhostGetDetails answer into (vhost name, configuration list).
+		"""
+		details=response['zendServerAPIResponse']['responseData']['vhostDetails']
+		template=details['vhostExtended']['template']
+		return details['vhostInfo']['name'],[{'name': 'template','value':('' if template is None else template)}]
+
 	def vhost_edit(self,vhostid,template):
 		data = {'vhostId':vhostid,'template':template}
 		response = self.do_request("/ZendServer/Api/vhostEdit",data=data)
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 	def vhost_redeploy(self,vhostid):
 		data = {'vhost':vhostid}
 		response = self.do_request("/ZendServer/Api/vhostRedeploy",data=data)
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 	def synchronize_vhost(self,templates):
-		require_restart = False
-		for vhost in self.get_vhost_list():
-			require_redeploy=False
-			for servers in vhost['status']:
-				if servers['status'] == 'Modified':
-					print ("vHost has been modified on Disk on server "+servers['id']+"! Reverting to configured value")
-					require_redeploy=True
-			if require_redeploy:
-				self.vhost_redeploy(vhost['id'])
-				require_restart=True
-			if (vhost['baseurl'] in templates):
-				current_template = self.get_vhost_config(vhost['id'])[vhost['baseurl']][0]['value'].rstrip().lstrip()
-				configuration_template = (templates[vhost['baseurl']][0]['value']).rstrip().lstrip()
-				if (current_template != configuration_template):
-					print ("Sync in progress: "+vhost['baseurl']+' ('+vhost['id']+')')
-					self.vhost_edit(vhost['id'],configuration_template)
-					require_restart=True
-		if (require_restart):
-			self.restart_php()
-		#print (templates)
+		return self.reconcile({'vhosts':templates})
 
-	def restart_php(self):
+	def restart_php(self,wait=True):
 		print ("Restarting: PHP", end='', flush=True)
 		data = {'force':'FALSE'}
 		response = self.do_request("/ZendServer/Api/restartPhp",data=data)
-		self.wait_for_task_complete()
-		return xmltodict.parse(response.text)
+		if wait:
+			self.wait_for_task_complete()
+		return self.parse_response(response)
 
 	def configuration_directives_list(self):
-		response = self.do_request("/ZendServer/Api/configurationDirectivesList")
-		return xmltodict.parse(response.text)
+		return self.cached_request("/ZendServer/Api/configurationDirectivesList")
 
 	def configuration_extensions_list(self):
-		response = self.do_request("/ZendServer/Api/configurationExtensionsList")
-		return xmltodict.parse(response.text)
+		return self.cached_request("/ZendServer/Api/configurationExtensionsList")
+
+	def extension_records(self):
+		"""
+		Return the extensions as Extension records, built while the answer is parsed.
+		"""
+		return [Extension.from_record(extension) for extension in self.stream_records('/ZendServer/Api/configurationExtensionsList',
+																					   ('zendServerAPIResponse','responseData','extensions','extension'))]
 
 	def get_extensions_config(self):
-		configuration={'extensions':[]}
-		response = self.configuration_extensions_list()
-		for extension in response['zendServerAPIResponse']['responseData']['extensions']['extension']:
-			configuration['extensions'].append({'name':extension['name'],'value':extension['loaded']})
-		return configuration
+		return {'extensions':[{'name':extension.name,'value':extension.value} for extension in self.extension_records()]}
 
 
 	def configuration_extensions_on(self,params=[]):
@@ -365,7 +1526,7 @@ class ZendClient:
 			data['extensions['+str(counter)+']']=param
 			counter = counter+1
 		response = self.do_request("/ZendServer/Api/configurationExtensionsOn",data=data)
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 
 	def configuration_extensions_off(self,params=[]):
@@ -375,94 +1536,282 @@ class ZendClient:
 			data['extensions['+str(counter)+']']=param
 			counter = counter+1
 		response = self.do_request("/ZendServer/Api/configurationExtensionsOff",data=data)
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 	def synchronize_extensions(self,params):
-		require_restart = False
-		config_params={}
-		for param in params['extensions']:
-			config_params[param['name']]=param['value']
-
-		to_enable=[]
-		to_disable=[]
 		if ('extensions' not in params):
 			print ("No extension provided")
-		else:
-			for param in self.get_extensions_config()['extensions']:
-				if param['name'] in config_params:
-					if param['value']!=config_params[param['name']]:
-						print ("Synchronizing Exenstion "+param['name']+", new: "+config_params[param['name']]+", old: "+param['value'])
-						if config_params[param['name']] == 'true':
-							to_enable.append(param['name'])
-							require_restart=True
-						else:
-							to_disable.append(param['name'])
-							require_restart=True
-			if (len(to_enable) > 0):
-				self.configuration_extensions_on(to_enable)
-			if (len(to_disable) > 0):
-				self.configuration_extensions_off(to_disable)
-
-			if (require_restart):
-				self.restart_php()
+			return None
+		return self.reconcile({'extensions':params['extensions']})
 
 	def configuration_store_directives(self,params=[]):
 		data = {}
 		for param in params:
 			data['directives['+param['name']+']']=param['value']
 		response = self.do_request("/ZendServer/Api/configurationStoreDirectives",data=data)
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
+
+	def directive_records(self):
+		"""
+		Return the directives as Directive records, built while the answer is parsed.
+		"""
+		return [Directive.from_record(directive) for directive in self.stream_records('/ZendServer/Api/configurationDirectivesList',
+																					   ('zendServerAPIResponse','responseData','directives','directive'))]
 
 	def get_directives_config(self):
-		configuration={'directives':[]}
-		response = self.configuration_directives_list()
-		for directive in response['zendServerAPIResponse']['responseData']['directives']['directive']:
-			directive_value= (directive['fileValue'] if directive['fileValue'] is not None else directive['defaultValue'])
-			configuration['directives'].append({'name':directive['name'],'value':('' if directive_value is None else directive_value)})
-		return configuration
+		return {'directives':[{'name':directive.name,'value':directive.value} for directive in self.directive_records()]}
 
 
 	def synchronize_directives(self,params):
-		require_restart = False
-		config_params={}
-		to_edit=[]
-		for param in params['directives']:
-			config_params[param['name']]=param['value']
-
-
 		if ('directives' not in params):
 			print ("No directives provided")
-		else:
-			for param in self.get_directives_config()['directives']:
-				if param['name'] in config_params:
-					if param['value']!=config_params[param['name']]:
-						print ("Synchronizing directives "+param['name']+", new: "+config_params[param['name']]+", old: "+param['value'])
-						to_edit.append({'name':param['name'],'value':config_params[param['name']]})
-						require_restart=True
+			return None
+		return self.reconcile({'directives':params['directives']})
+
+	def jobqueue_update_queue(self,queueid,params):
+		"""
+		Update the settings of a job queue.
+
+		:param queueid: Id of the queue
+		:param params: Dict of settings named as in jobqueueGetQueues (priority, max_http_jobs...)
 
-			if (len(to_edit) > 0):
-				self.configuration_store_directives(to_edit)
+		"""
+		data = {'id':queueid}
+		for name,value in params.items():
+			data[self.JOBQUEUE_PARAMETERS.get(name,name)]=value
+		response = self.do_request("/ZendServer/Api/jobqueueUpdateQueue",data=data)
+		return self.parse_response(response)
+
+	def get_state_snapshot(self,desired):
+		"""
+		Fetch, concurrently and once, the current state of every section present in desired.
+		Sections other than vhosts are indexed by name (see index_records).
+		"""
+		fetchers = {}
+		if 'vhosts' in desired:
+			fetchers['vhosts'] = self.vhost_records
+		if 'extensions' in desired:
+			fetchers['extensions'] = lambda: index_records(self.extension_records())
+		if 'directives' in desired:
+			fetchers['directives'] = lambda: index_records(self.directive_records())
+		if 'job_queues' in desired:
+			fetchers['job_queues'] = lambda: index_records(self.jobqueue_records())
+		snapshot = dict(zip(fetchers,self.fetch_all(lambda fetch: fetch(),fetchers.values())))
+
+		if 'vhosts' in desired:
+			snapshot['vhost_templates'] = self.get_vhosts_details_config([vhost.id for vhost in snapshot['vhosts'] if vhost.baseurl in desired['vhosts']])
+		return snapshot
+
+	def jobqueue_records(self):
+		"""
+		Return the job queues as JobQueue records.
+		"""
+		queues = self.jobqueue_get_queues()['zendServerAPIResponse']['responseData']['queues']
+		queues = [] if queues is None else queues['queue']
+		return [JobQueue.from_record(queue) for queue in (queues if type(queues) is list else [queues])]
 
-			if (require_restart):
-				self.restart_php()
+	def plan(self,desired,snapshot=None):
+		"""
+		Compute everything needed to bring the server to the desired state.
+
+		:param desired: Dict with any of the sections 'vhosts' (as get_vhost_config), 'extensions', 'directives' and 'job_queues' (as the list of the get_*_config methods)
+		:param snapshot: Current state as returned by get_state_snapshot, fetched when not provided
+		:return: Dict of the actions to perform, see apply_plan
+
+		"""
+		if snapshot is None:
+			snapshot = self.get_state_snapshot(desired)
+		plan = {'vhost_redeploy':[],
+				'vhost_edit':[],
+				'extensions_on':[],
+				'extensions_off':[],
+				'directives':[],
+				'job_queues':[]}
+
+		templates = desired.get('vhosts',{})
+		for vhost in snapshot.get('vhosts',[]):
+			modified = [server for server,status in vhost.status if status == 'Modified']
+			if modified:
+				plan['vhost_redeploy'].append({'id':vhost.id,'baseurl':vhost.baseurl,'servers':modified})
+			if (vhost.baseurl in templates):
+				current_template = snapshot['vhost_templates'][vhost.baseurl][0]['value'].strip()
+				configuration_template = templates[vhost.baseurl][0]['value'].strip()
+				if (current_template != configuration_template):
+					plan['vhost_edit'].append({'id':vhost.id,'baseurl':vhost.baseurl,'template':configuration_template})
+
+		current = snapshot.get('extensions',{})
+		for param in desired.get('extensions',[]):
+			extension = current.get(param['name'])
+			if extension is not None and extension.value != param['value']:
+				change = {'name':param['name'],'value':param['value'],'old':extension.value}
+				plan['extensions_on' if change['value'] == 'true' else 'extensions_off'].append(change)
+
+		current = snapshot.get('directives',{})
+		for param in desired.get('directives',[]):
+			directive = current.get(param['name'])
+			if directive is not None and directive.value != param['value']:
+				plan['directives'].append({'name':param['name'],'value':param['value'],'old':directive.value})
+
+		plan['job_queues'] = self.jobqueue_changes(desired.get('job_queues',[]),snapshot.get('job_queues',{}))
+
+		#Job queues live in jqd and do not need PHP to restart
+		plan['restart'] = any(plan[action] for action in ('vhost_redeploy','vhost_edit','extensions_on','extensions_off','directives'))
+		return plan
+
+	def print_plan(self,plan):
+		for vhost in plan['vhost_redeploy']:
+			print ("vHost "+vhost['baseurl']+" has been modified on Disk on server(s) "+', '.join(vhost['servers'])+"! Reverting to configured value")
+		for vhost in plan['vhost_edit']:
+			print ("Sync in progress: "+vhost['baseurl']+' ('+vhost['id']+')')
+		for param in plan['extensions_on']+plan['extensions_off']:
+			print ("Synchronizing Extension "+param['name']+", new: "+param['value']+", old: "+param['old'])
+		for param in plan['directives']:
+			print ("Synchronizing directives "+param['name']+", new: "+param['value']+", old: "+param['old'])
+		for queue in plan['job_queues']:
+			print ("Synchronizing job queue "+queue['name']+": "+json.dumps(queue['settings'],sort_keys=True))
+		if plan['restart']:
+			print ("PHP will be restarted once")
+
+	def apply_plan(self,plan):
+		"""
+		Perform all the edits of a plan, then restart PHP once if any of them requires it.
+		"""
+		for vhost in plan['vhost_redeploy']:
+			self.vhost_redeploy(vhost['id'])
+		for vhost in plan['vhost_edit']:
+			self.vhost_edit(vhost['id'],vhost['template'])
+		if plan['extensions_on']:
+			self.configuration_extensions_on([param['name'] for param in plan['extensions_on']])
+		if plan['extensions_off']:
+			self.configuration_extensions_off([param['name'] for param in plan['extensions_off']])
+		if plan['directives']:
+			self.configuration_store_directives(plan['directives'])
+		self.fetch_all(lambda queue: self.jobqueue_update_queue(queue['id'],queue['settings']),plan['job_queues'])
+		if plan['restart']:
+			self.restart_php()
+
+	def reconcile(self,desired,dry_run=False):
+		"""
+		Bring the server to the desired state from a single snapshot, with at most one PHP restart.
 
-	def application_update(self,params=[]):
+		:param desired: See plan
+		:param dry_run: Only print the plan, without touching the server
+		:return: The plan
+
+		"""
+		plan = self.plan(desired)
+		self.print_plan(plan)
+		if not dry_run:
+			self.apply_plan(plan)
+		return plan
+
+	def snapshot(self,path=None,previous=None,max_age=None):
+		"""
+		Capture the whole configuration of the server (applications, vhosts, directives,
+		extensions, job queues) concurrently, as one versioned snapshot.
+
+		Every section carries the fingerprint of its list-level answer, a hash of its
+		content and the date its data was fetched. Given a previous snapshot, the
+		applications and vhosts details are only fetched again when their list fingerprint
+		changed, or when they are older than max_age.
+
+		The lists only carry ids, names, status and deployed versions: a template changed
+		by vhostEdit, or user params changed by an applicationUpdate of the same release,
+		leave the fingerprint unchanged. Without max_age such reused details can be stale,
+		their 'fetched' date tells how much; pass max_age=0 to always fetch them again.
+
+		:param path: Where to write the snapshot (JSON lines, see write_snapshot)
+		:param previous: Previous snapshot, or path to it, of the same server
+		:param max_age: Seconds after which details from the previous snapshot are fetched again
+		:return: The snapshot
+
+		"""
+		if isinstance(previous,str):
+			previous = load_snapshot(previous) if os.path.exists(previous) else None
+		if previous is not None and previous['host'] != self.__host:
+			previous = None
+		previous_sections = {} if previous is None else previous['sections']
+
+		lists = dict(zip(('applications','vhosts','directives','extensions','job_queues'),
+						 self.fetch_all(lambda fetch: fetch(),
+										(self.get_application_list,
+										 self.get_vhost_list,
+										 lambda: self.get_directives_config()['directives'],
+										 lambda: self.get_extensions_config()['extensions'],
+										 lambda: self.get_jobqueue_config()['job_queues']))))
+		fingerprints = {name:content_hash(value) for name,value in lists.items()}
+
+		details = {'applications':lambda: self.get_applications_details_config([application['id'] for application in lists['applications']]),
+				   'vhosts':lambda: self.get_vhosts_details_config([vhost['id'] for vhost in lists['vhosts']])}
+		now = datetime.datetime.now(datetime.timezone.utc)
+		def reusable(name):
+			section = previous_sections.get(name)
+			if section is None or section['fingerprint'] != fingerprints[name] or 'fetched' not in section:
+				return False
+			return max_age is None or (now-datetime.datetime.fromisoformat(section['fetched'])).total_seconds() < max_age
+		refetch = [name for name in details if not reusable(name)]
+		sections = {name:previous_sections[name]['data'] for name in details if name not in refetch}
+		fetched = {name:previous_sections[name]['fetched'] for name in sections}
+		sections.update(zip(refetch,self.fetch_all(lambda name: details[name](),refetch)))
+		for name in ('directives','extensions','job_queues'):
+			sections[name] = lists[name]
+
+		snapshot = {'format':SNAPSHOT_FORMAT,
+					'version':SNAPSHOT_VERSION,
+					'host':self.__host,
+					'created':now.isoformat(),
+					'refetched':sorted(refetch),
+					'sections':{name:{'fingerprint':fingerprints[name],'hash':content_hash(data),
+									  'fetched':fetched.get(name,now.isoformat()),'data':data}
+								for name,data in sections.items()}}
+		if path is not None:
+			write_snapshot(snapshot,path)
+		return snapshot
+
+	def application_update(self,params=[],progress=None):
 		multipart_data = MultipartEncoder(params)
-		response = self.do_request("/ZendServer/Api/applicationUpdate",multipart_data=multipart_data)
-		return self.wait_for_deployment(xmltodict.parse(response.text))
-
-	def wait_for_deployment(self,apireturn):
-		applicationid = apireturn['zendServerAPIResponse']['responseData']['applicationInfo']['id']
-		applicationstatus = apireturn['zendServerAPIResponse']['responseData']['applicationInfo']['status']
-		print ("Deployment Status: "+applicationstatus)
-		while (applicationstatus != 'deployed'):
-			time.sleep(2)
-			apireturn = self.application_get_status(applicationid)
-			applicationstatus = apireturn['zendServerAPIResponse']['responseData']['applicationsList']['applicationInfo']['status']
-			print ("Deployment Status: "+applicationstatus)
-		return apireturn
-
-	def deploy_or_update(self,filename,configuration):
+		response = self.do_request("/ZendServer/Api/applicationUpdate",multipart_data=multipart_data,progress=progress)
+		return self.wait_for_deployment(self.parse_response(response))
+
+	def timed_wait(self,kind,wait,*args,**kwargs):
+		start = time.monotonic()
+		try:
+			return wait(*args,**kwargs)
+		finally:
+			self.instrumentation.wait(kind,time.monotonic()-start)
+
+	def wait_for_deployment(self,apireturn,timeout=None):
+		return self.wait_for_deployments([apireturn],timeout)[0]
+
+	def wait_for_deployments(self,apireturns,timeout=None):
+		"""
+		Wait in a single polling loop until all the applications deployed/updated are 'deployed'.
+
+		:param apireturns: applicationDeploy/applicationUpdate answers
+		:param timeout: Overrides the waiter timeout (seconds)
+		:return: The final applicationGetStatus answers, in the same order
+
+		"""
+		waits={}
+		for apireturn in apireturns:
+			applicationid = apireturn['zendServerAPIResponse']['responseData']['applicationInfo']['id']
+			print ("Deployment Status: "+apireturn['zendServerAPIResponse']['responseData']['applicationInfo']['status'])
+			waits[applicationid] = (functools.partial(self.application_get_status,applicationid,use_cache=False),
+									lambda apireturn: self.deployment_status(apireturn) == 'deployed')
+
+		def on_poll(applicationid,apireturn):
+			print ("Deployment Status: "+self.deployment_status(apireturn))
+
+		results = self.timed_wait('deployment',self.waiter.wait_many,waits,timeout=timeout,on_poll=on_poll)
+		for apireturn in results.values():
+			print ("Deployment Status: "+self.deployment_status(apireturn))
+		return [results[applicationid] for applicationid in waits]
+
+	@staticmethod
+	def deployment_status(apireturn):
+		return apireturn['zendServerAPIResponse']['responseData']['applicationsList']['applicationInfo']['status']
+
+	def deploy_or_update(self,filename,configuration,progress=None):
 		validation_data=self.validate_configuration(filename,configuration)
 		if (validation_data['status']):
 			print ("Validation sucessfull")
@@ -489,23 +1838,23 @@ class ZendClient:
 					applicationid=application['id']
 					displayname=application['displayname']
 
-			parameters.append(('appPackage',(filename, open(filename, 'rb'), 'application/vnd.zend.applicationpackage')))
-
 			print (baseurl)
 			print (displayname)
 
-			if (applicationid is None):
-				parameters.append(('baseUrl',baseurl))
-				parameters.append(('userAppName',displayname))
-				parameters.append(('createVhost','true'))
-				return self.application_deploy(parameters)
-			else:
-				parameters.append(('appId',applicationid))
-				return self.application_update(parameters)
+			with open(filename, 'rb') as package:
+				parameters.append(('appPackage',(filename, package, 'application/vnd.zend.applicationpackage')))
+				if (applicationid is None):
+					parameters.append(('baseUrl',baseurl))
+					parameters.append(('userAppName',displayname))
+					parameters.append(('createVhost','true'))
+					return self.application_deploy(parameters,progress=progress)
+				else:
+					parameters.append(('appId',applicationid))
+					return self.application_update(parameters,progress=progress)
 
 		return False
 
-	def deploy_or_update_by_id(self,filename,configuration,applicationid):
+	def deploy_or_update_by_id(self,filename,configuration,applicationid,progress=None):
 		print (filename)
 
 		validation_data=self.validate_configuration(filename,configuration)
@@ -523,74 +1872,89 @@ class ZendClient:
 				else:
 					parameters.append(('userParams['+configuration_items['name']+']',configuration_items['value']))
 
-			parameters.append(('appPackage',(filename, open(filename, 'rb'), 'application/vnd.zend.applicationpackage')))
-
 			print (baseurl)
 			print (displayname)
 
-			if (applicationid is None):
-				parameters.append(('baseUrl',baseurl))
-				parameters.append(('userAppName',displayname))
-				parameters.append(('createVhost','true'))
-				return self.application_deploy(parameters)
-			else:
-				parameters.append(('appId',applicationid))
-				return self.application_update(parameters)
+			with open(filename, 'rb') as package:
+				parameters.append(('appPackage',(filename, package, 'application/vnd.zend.applicationpackage')))
+				if (applicationid is None):
+					parameters.append(('baseUrl',baseurl))
+					parameters.append(('userAppName',displayname))
+					parameters.append(('createVhost','true'))
+					return self.application_deploy(parameters,progress=progress)
+				else:
+					parameters.append(('appId',applicationid))
+					return self.application_update(parameters,progress=progress)
 
 		return False
 
 	def validate_configuration(self,filename,configuration):
-		archive = zipfile.ZipFile(filename, 'r')
-		xmldata = archive.read('deployment.xml')
-
-		package_config=xmltodict.parse(xmldata)
-		if package_config['package']['name'] not in configuration:
-			return {'status':False,'name':package_config['package']['name']}
-		if 'parameters' not in package_config['package']:
-			return {'status':True,'name':package_config['package']['name']}
-		if package_config['package']['parameters'] is None:
-			return {'status':True,'name':package_config['package']['name']}
-
-		is_valid = True
-		for parameter in package_config['package']['parameters']['parameter']:
-			is_parameter_valid=False
-			if parameter['@required'] == 'true':
-				for config in configuration[package_config['package']['name']]:
-					if config['name'] == parameter['@id'] and config['value'] is not '':
-						if 'validation' in parameter:
-							if config['value'] in parameter['validation']['enums']['enum']:
-								is_parameter_valid=True
-						else:
-							is_parameter_valid = True
-			else:
-				is_parameter_valid = True
+		"""
+		Check the configuration of the package against its deployment descriptor.
+
+		:return: Dict with status (bool), name (package name) and errors (list of {'parameter','reason'})
 
-			if is_parameter_valid == False:
-				is_valid=False
-		return {'status':is_valid,'name':package_config['package']['name']}
+		"""
+		package = ZpkPackage.load(filename)
+		if package.name not in configuration:
+			return {'status':False,'name':package.name,'errors':[{'parameter':None,'reason':'no configuration for package '+package.name}]}
+
+		errors = package.validate(configuration[package.name])
+		for error in errors:
+			print ("Invalid parameter "+str(error['parameter'])+": "+error['reason'])
+		return {'status':not errors,'name':package.name,'errors':errors}
 
 	def tasks_complete(self):
 		response = self.do_request("/ZendServer/Api/tasksComplete")
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
-	def wait_for_task_complete(self):
-		while (self.tasks_complete()['zendServerAPIResponse']['responseData']['tasksComplete'] != 'true'):
-			print (".", end='', flush=True)
-			time.sleep(2)
+	def wait_for_task_complete(self,timeout=None):
+		self.timed_wait('tasks',self.waiter.wait,self.tasks_complete,
+						lambda response: response['zendServerAPIResponse']['responseData']['tasksComplete'] == 'true',
+						timeout=timeout,
+						on_poll=lambda response: print (".", end='', flush=True))
 		print (" complete")
 
-	def restart_daemon(self,param):
+	def wait_for_server_ready(self,server_id=None,timeout=None):
+		"""
+		Wait until the server is done restarting/redeploying and return its status.
+		"""
+		response = self.timed_wait('server',self.waiter.wait,functools.partial(self.cluster_get_server_status,server_id),
+									lambda response: self.server_status(response) not in ('restarting','redeploying'),
+									timeout=timeout,
+									on_poll=lambda response: print (".", end='', flush=True))
+		return self.server_status(response)
+
+	@staticmethod
+	def server_status(response):
+		return response['zendServerAPIResponse']['responseData']['serversList']['serverInfo']['status']
+
+	def restart_daemon(self,param,wait=True):
 		print ("Restarting: "+param, end='', flush=True)
 		data={'daemon':param}
 		response = self.do_request("/ZendServer/Api/restartDaemon",data=data)
+		if wait:
+			self.wait_for_task_complete()
+		return self.parse_response(response)
+
+	def restart_daemons(self,daemons,php=True):
+		"""
+		Request the restart of several daemons (and PHP), then wait once for all the tasks.
+		"""
+		for daemon in daemons:
+			self.restart_daemon(daemon,wait=False)
+			print ("")
+		if php:
+			self.restart_php(wait=False)
 		self.wait_for_task_complete()
-		return xmltodict.parse(response.text)
 
 	def cluster_get_server_status(self,server_id=None):
 		response = self.do_request("/ZendServer/Api/clusterGetServerStatus"+("?servers[0]="+server_id if server_id is not None else ''))
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 	def bootstrap_single_server(self,nodeip,password,order_number,license_key,production=True):
+		if self.__bound and self.__host != nodeip+':10081':
+			raise RuntimeError("This client is bound to %s, it cannot bootstrap %s" % (self.__host,nodeip))
 		print ("Bootstrapping server.", end='', flush=True)
 		self.__host=nodeip+':10081'
 		data={'production':production,
@@ -601,34 +1965,30 @@ class ZendClient:
 		response = self.do_request("/ZendServer/Api/bootstrapSingleServer",data=data)
 
 		#Setting target automaticaly. Required for the next calls!
-		self.__key=xmltodict.parse(response.text)['zendServerAPIResponse']['responseData']['bootstrap']['apiKey']['name']
-		self.__hash=xmltodict.parse(response.text)['zendServerAPIResponse']['responseData']['bootstrap']['apiKey']['hash']
+		apikey=self.parse_response(response)['zendServerAPIResponse']['responseData']['bootstrap']['apiKey']
+		self.__key=apikey['name']
+		self.__hash=apikey['hash']
+		self.__signer=None
 		self.wait_for_task_complete()
 
 		#Restarting all the other deamons as they are always in that state post bootstrap.
-		self.restart_daemon('jqd')
-		self.restart_daemon('scd')
-		self.restart_daemon('zdd')
-		self.restart_php()
+		self.restart_daemons(('jqd','scd','zdd'))
 
 		if (self.cluster_get_server_status()['zendServerAPIResponse']['responseData']['serversList']['serverInfo']['status'] != 'OK'):
 			print ("WARNING: SERVER IS NOT IN A CORRECT STATE. DO NOT PERFORM ADD CLUSTER!")
 			return None
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 	def cluster_add_server(self,servername,nodeip):
 		print ("Joining Cluster.", end='', flush=True)
 		data={'serverName':servername,
 			  'serverIp':nodeip}
 		response = self.do_request("/ZendServer/Api/clusterAddServer",data=data)
-		server_id = (xmltodict.parse(response.text)['zendServerAPIResponse']['responseData']['serverInfo']['id'])
+		server_id = (self.parse_response(response)['zendServerAPIResponse']['responseData']['serverInfo']['id'])
 
 		self.wait_for_task_complete()
 		print ("Restarting and redeploying.", end='', flush=True)
-		while (self.cluster_get_server_status(server_id)['zendServerAPIResponse']['responseData']['serversList']['serverInfo']['status'] in  ('restarting','redeploying')):
-			print (".", end='', flush=True)
-			time.sleep(2)
-		if (self.cluster_get_server_status(server_id)['zendServerAPIResponse']['responseData']['serversList']['serverInfo']['status'] != 'OK'):
+		if (self.wait_for_server_ready(server_id) != 'OK'):
 			print ("WARNING: SERVER IS NOT IN A CORRECT STATE. DO NOT PERFORM ANY OTHER ACTION!")
 			return None
 		print (" complete")
@@ -639,9 +1999,8 @@ class ZendClient:
 				restart_required=True
 		if (restart_required):
 			print ("At least one of the server is not in a correct state. Restarting scd/php.")
-			self.restart_daemon('scd')
-			self.restart_php()
-		return xmltodict.parse(response.text)
+			self.restart_daemons(('scd',))
+		return self.parse_response(response)
 
 	def server_add_to_cluster(self,servername,dbhost,dbuser,dbpassword,nodeip,dbname):
 		print ("Creating Cluster.", end='', flush=True)
@@ -654,19 +2013,430 @@ class ZendClient:
 		response = self.do_request("/ZendServer/Api/serverAddToCluster",data=data)
 		self.wait_for_task_complete()
 		print ("Restarting and redeploying.", end='', flush=True)
-		while (self.cluster_get_server_status()['zendServerAPIResponse']['responseData']['serversList']['serverInfo']['status'] in  ('restarting','redeploying')):
-			print (".", end='', flush=True)
-			time.sleep(2)
-		if (self.cluster_get_server_status()['zendServerAPIResponse']['responseData']['serversList']['serverInfo']['status'] != 'OK'):
+		if (self.wait_for_server_ready() != 'OK'):
 			print ("WARNING: SERVER IS NOT IN A CORRECT STATE. DO NOT PERFORM ANY OTHER ACTION!")
 			return None
 		print (" complete")
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 	def get_system_info(self,server_id=None):
 		response = self.do_request("/ZendServer/Api/getSystemInfo")
-		return xmltodict.parse(response.text)
+		return self.parse_response(response)
 
 	def get_server_info(self,server_id=0):
 		response = self.do_request("/ZendServer/Api/getServerInfo?serverId="+str(server_id))
-		return xmltodict.parse(response.text)
\ No newline at end of file
+		return self.parse_response(response)
+
+
+SNAPSHOT_FORMAT = 'zendclient-snapshot'
+SNAPSHOT_VERSION = 1
+
+def content_hash(data):
+	"""
+	sha256 of the canonical JSON serialization of data.
+	"""
+	return hashlib.sha256(json.dumps(data,sort_keys=True,separators=(',',':')).encode('utf-8')).hexdigest()
+
+def write_snapshot(snapshot,path):
+	"""
+	Write a snapshot as JSON lines: a header line (format, version, host, creation date and
+	the fingerprint/hash/fetch date of every section), then one line per section with its data.
+	The file is replaced atomically.
+	"""
+	header = {key:value for key,value in snapshot.items() if key != 'sections'}
+	header['sections'] = {name:{key:section[key] for key in ('fingerprint','hash','fetched')} for name,section in snapshot['sections'].items()}
+	with open(path+'.tmp','w') as output:
+		output.write(json.dumps(header,separators=(',',':'))+'\n')
+		for name,section in sorted(snapshot['sections'].items()):
+			output.write(json.dumps({'section':name,'data':section['data']},separators=(',',':'))+'\n')
+	os.replace(path+'.tmp',path)
+
+def load_snapshot(path,verify=True):
+	"""
+	Read a snapshot written by write_snapshot.
+
+	:param verify: Check the content hash of every section
+	:raises ValueError: Unknown format or version, or corrupted section
+
+	"""
+	with open(path) as source:
+		snapshot = json.loads(source.readline())
+		if snapshot.get('format') != SNAPSHOT_FORMAT or snapshot.get('version') != SNAPSHOT_VERSION:
+			raise ValueError("%s is not a version %d snapshot" % (path,SNAPSHOT_VERSION))
+		for line in source:
+			section = json.loads(line)
+			snapshot['sections'][section['section']]['data'] = section['data']
+			if verify and content_hash(section['data']) != snapshot['sections'][section['section']]['hash']:
+				raise ValueError("Section %s of %s does not match its hash" % (section['section'],path))
+	return snapshot
+
+
+def rollout(targets,filename,configuration,parallelism=4,batch_size=None,stop_on_failure=True,client_options=None):
+	"""
+	Deploy (or update) a ZPK on several Zend Servers concurrently.
+
+	Targets are processed in batches of batch_size, at most parallelism at a time.
+	With stop_on_failure, a failure stops starting new deployments: the targets left
+	are reported as 'skipped'.
+
+	:param targets: List of dicts with host, key and hash, as for ZendClient.set_target
+	:param filename: Path to the ZPK
+	:param configuration: Configuration, as for ZendClient.deploy_or_update
+	:param parallelism: Maximum number of nodes deployed at the same time
+	:param batch_size: Number of nodes per batch (all the targets in one batch by default)
+	:param stop_on_failure: Do not start new deployments once one has failed
+	:param client_options: Keyword arguments for each ZendClient
+	:return: List of dicts host, status ('deployed', 'failed' or 'skipped'), duration (seconds) and error, in the targets order
+
+	"""
+	client_options = client_options or {}
+	batch_size = batch_size or len(targets) or 1
+	report = [{'host':target['host'],'status':'skipped','duration':None,'error':None} for target in targets]
+
+	def deploy(index):
+		client = ZendClient(target=targets[index],**client_options)
+		start = time.monotonic()
+		try:
+			if client.deploy_or_update(filename,configuration) is False:
+				report[index].update(status='failed',error='Invalid configuration')
+			else:
+				report[index]['status'] = 'deployed'
+		except Exception as error:
+			report[index].update(status='failed',error=repr(error))
+		finally:
+			report[index]['duration'] = time.monotonic()-start
+			client.close()
+		return report[index]['status'] == 'deployed'
+
+	failed = False
+	with ThreadPoolExecutor(max_workers=parallelism) as executor:
+		for batch_start in range(0,len(targets),batch_size):
+			pending = {executor.submit(deploy,index) for index in range(batch_start,min(batch_start+batch_size,len(targets)))}
+			while pending:
+				done,pending = wait(pending,return_when=FIRST_COMPLETED)
+				if stop_on_failure and any(not future.cancelled() and not future.result() for future in done):
+					failed = True
+					for future in pending:
+						future.cancel()
+			if failed:
+				break
+
+	for node in report:
+		print ("%-30s %-10s %s" % (node['host'],node['status'],'-' if node['duration'] is None else '%.1fs' % node['duration']))
+	return report
+
+
+class AsyncZendClient:
+	"""
+	asyncio front-end for ZendClient.
+
+	Every public method of ZendClient is available as a coroutine with the same
+	arguments. Requests are signed by the wrapped ZendClient (generate_signature)
+	and run in a thread pool, while a semaphore bounds how many of them are in
+	flight. The *_config methods fetch their details concurrently, so N items
+	take roughly the time of the slowest call.
+
+	Example:
+		client = AsyncZendClient(concurrency=16)
+		client.set_target({'host':'10.0.0.1:10081','key':'admin','hash':'...'})
+		configuration = asyncio.run(client.get_applications_config())
+	"""
+
+	def __init__(self,client=None,concurrency=8):
+		"""
+		:param client: ZendClient to wrap. A new one, with a connection pool sized for the concurrency, is created by default
+		:param concurrency: Maximum number of requests in flight
+
+		"""
+		self.client = ZendClient(pool_size=concurrency) if client is None else client
+		self.__concurrency = concurrency
+		#asyncio primitives belong to one event loop: one semaphore per loop running calls
+		self.__semaphores = weakref.WeakKeyDictionary()
+		self.__semaphores_lock = threading.Lock()
+		self.__executor = ThreadPoolExecutor(max_workers=concurrency)
+
+	def __repr__(self):
+		return "AsyncZendClient(client=%r)" % (self.client,)
+
+	def __getattr__(self,name):
+		if name == 'client':
+			raise AttributeError(name)
+		attribute = getattr(self.client,name)
+		if name.startswith('_') or not callable(attribute):
+			return attribute
+
+		@functools.wraps(attribute)
+		async def method(*args,**kwargs):
+			return await self.call(attribute,*args,**kwargs)
+		return method
+
+	def set_target(self,data):
+		self.client.set_target(data)
+
+	async def call(self,function,*args,**kwargs):
+		"""
+		Run a blocking ZendClient call in the thread pool, within the concurrency limit.
+		"""
+		loop = asyncio.get_running_loop()
+		with self.__semaphores_lock:
+			semaphore = self.__semaphores.get(loop)
+			if semaphore is None:
+				semaphore = self.__semaphores[loop] = asyncio.Semaphore(self.__concurrency)
+		async with semaphore:
+			return await loop.run_in_executor(self.__executor,functools.partial(function,*args,**kwargs))
+
+	async def gather(self,function,items):
+		"""
+		Call function once per item concurrently and return the results in the items order.
+		"""
+		return await asyncio.gather(*(self.call(function,item) for item in items))
+
+	async def get_applications_config(self,applicationid=None):
+		if (applicationid is None):
+			applicationlist = [application['id'] for application in await self.call(self.client.get_application_list)]
+		else:
+			applicationlist = [applicationid]
+
+		configuration={}
+		for response in await self.gather(self.client.application_get_details,applicationlist):
+			packagename,parameters = ZendClient.parse_application_details(response)
+			configuration[packagename]=parameters
+		return configuration
+
+	async def get_vhost_config(self,vhostid=None):
+		if (vhostid is None):
+			vhostlist = [vhost['id'] for vhost in await self.call(self.client.get_vhost_list)]
+		else:
+			vhostlist = [vhostid]
+
+		configuration={}
+		for response in await self.gather(self.client.vhost_get_details,vhostlist):
+			vhostname,template = ZendClient.parse_vhost_details(response)
+			configuration[vhostname]=template
+		return configuration
+
+	async def cluster_get_servers_status(self,server_ids):
+		"""
+		Query the status of every server of server_ids concurrently.
+		Return a dict server id => clusterGetServerStatus answer.
+		"""
+		return dict(zip(server_ids,await self.gather(self.client.cluster_get_server_status,server_ids)))
+
+	def close(self):
+		self.__executor.shutdown(wait=True)
+		self.client.close()
+
+
+class ZendRegistry:
+	"""
+	Clients of a fleet of Zend Servers, keyed by target name.
+
+	Each target gets its own ZendClient, bound to it (see ZendClient target), with its own
+	connection pool and response cache, created on first use. Clients are safe to use
+	from thread pools, and async_client gives an AsyncZendClient for asyncio code.
+
+	Example:
+		registry = ZendRegistry({'web1':{'host':'10.0.0.1:10081','key':'admin','hash':'...'},
+								 'web2':{'host':'10.0.0.2:10081','key':'admin','hash':'...'}},
+								cache=True)
+		statuses = registry.map(lambda client: client.get_application_list())
+	"""
+
+	def __init__(self,targets=None,**client_options):
+		"""
+		:param targets: Dict name => dict with host, key and hash
+		:param client_options: Keyword arguments for every ZendClient. cache=True gives each client its own ResponseCache
+
+		"""
+		self.__targets = dict(targets or {})
+		self.__client_options = client_options
+		self.__clients = {}
+		self.__async_clients = {}
+		self.__lock = threading.Lock()
+
+	def __repr__(self):
+		return "ZendRegistry(targets=%r)" % (sorted(self.__targets),)
+
+	def __contains__(self,name):
+		return name in self.__targets
+
+	def __iter__(self):
+		return iter(list(self.__targets))
+
+	def __len__(self):
+		return len(self.__targets)
+
+	def __getitem__(self,name):
+		return self.get(name)
+
+	def add(self,name,target):
+		with self.__lock:
+			if name in self.__targets:
+				raise KeyError("Target %s is already registered" % (name,))
+			self.__targets[name] = dict(target)
+
+	def remove(self,name):
+		with self.__lock:
+			del self.__targets[name]
+			client = self.__clients.pop(name,None)
+			async_client = self.__async_clients.pop(name,None)
+		if async_client is not None:
+			async_client.close()
+		elif client is not None:
+			client.close()
+
+	def get(self,name):
+		"""
+		Return the client of the target name, created on first use.
+		"""
+		with self.__lock:
+			client = self.__clients.get(name)
+			if client is None:
+				client = self.__clients[name] = ZendClient(target=self.__targets[name],**self.__client_options)
+			return client
+
+	def async_client(self,name,concurrency=8):
+		"""
+		Return an AsyncZendClient sharing the client of the target name.
+		"""
+		client = self.get(name)
+		with self.__lock:
+			async_client = self.__async_clients.get(name)
+			if async_client is None:
+				async_client = self.__async_clients[name] = AsyncZendClient(client,concurrency)
+			return async_client
+
+	def map(self,function,names=None,parallelism=8):
+		"""
+		Call function(client) for each target concurrently.
+
+		:param names: Targets to use, all by default
+		:return: Dict name => result
+
+		"""
+		names = list(self.__targets) if names is None else list(names)
+		if not names:
+			return {}
+		with ThreadPoolExecutor(max_workers=min(parallelism,len(names))) as executor:
+			return dict(zip(names,executor.map(lambda name: function(self.get(name)),names)))
+
+	def close(self):
+		with self.__lock:
+			clients = list(self.__clients.values())
+			async_clients = list(self.__async_clients.values())
+			self.__clients = {}
+			self.__async_clients = {}
+		for async_client in async_clients:
+			async_client.close()
+		for client in clients:
+			client.close()
+
+
+class ClusterProvisioner:
+	"""
+	Build a Zend Server cluster out of fresh nodes.
+
+	All the nodes are bootstrapped in parallel (with one batched daemons/PHP restart each),
+	then joined to the cluster database one at a time, as the cluster requires. Progress
+	is saved in a checkpoint file after every step, so a run that failed halfway resumes
+	where it stopped. The checkpoint holds the API keys of the nodes: it is created 0600.
+
+	Example:
+		provisioner = ClusterProvisioner([{'name':'web1','ip':'10.0.0.1'},{'name':'web2','ip':'10.0.0.2'}],
+										 'adminpassword','order','license',
+										 {'host':'10.0.0.10','user':'zend','password':'...','name':'zend'},
+										 checkpoint='cluster.json')
+		provisioner.run()
+	"""
+
+	def __init__(self,nodes,password,order_number,license_key,database,checkpoint=None,production=True,parallelism=8,client_options=None):
+		"""
+		:param nodes: List of dicts with the server name and ip of each node
+		:param password: Admin password set on every node
+		:param order_number: Zend license order number
+		:param license_key: Zend license key
+		:param database: Dict with host, user, password and name of the cluster database
+		:param checkpoint: Path of the checkpoint file, no checkpoint when None
+		:param production: Bootstrap in production mode
+		:param parallelism: Maximum number of nodes bootstrapped at the same time
+		:param client_options: Keyword arguments for each ZendClient
+
+		"""
+		self.nodes = nodes
+		self.password = password
+		self.order_number = order_number
+		self.license_key = license_key
+		self.database = database
+		self.checkpoint = checkpoint
+		self.production = production
+		self.parallelism = parallelism
+		self.client_options = client_options or {}
+		self.__lock = threading.Lock()
+		self.state = self.load_state()
+
+	def __repr__(self):
+		return "ClusterProvisioner(nodes=%r, checkpoint=%r)" % ([node['name'] for node in self.nodes], self.checkpoint)
+
+	def load_state(self):
+		if self.checkpoint is not None and os.path.exists(self.checkpoint):
+			with open(self.checkpoint) as source:
+				return json.load(source)
+		return {'bootstrapped':{},'joined':[]}
+
+	def save_state(self):
+		if self.checkpoint is None:
+			return
+		descriptor = os.open(self.checkpoint+'.tmp',os.O_WRONLY|os.O_CREAT|os.O_TRUNC,0o600)
+		with os.fdopen(descriptor,'w') as output:
+			json.dump(self.state,output,indent=1,sort_keys=True)
+		os.replace(self.checkpoint+'.tmp',self.checkpoint)
+
+	def client(self,node):
+		apikey = self.state['bootstrapped'][node['name']]
+		return ZendClient(target={'host':node['ip']+':10081','key':apikey['key'],'hash':apikey['hash']},**self.client_options)
+
+	def bootstrap(self,node):
+		client = ZendClient(**self.client_options)
+		try:
+			if client.bootstrap_single_server(node['ip'],self.password,self.order_number,self.license_key,self.production) is None:
+				raise RuntimeError("Server %s is not in a correct state after bootstrap" % (node['name'],))
+			target = client.get_target()
+			with self.__lock:
+				self.state['bootstrapped'][node['name']] = {'key':target['key'],'hash':target['hash']}
+				self.save_state()
+		finally:
+			client.close()
+
+	def join(self,node):
+		client = self.client(node)
+		try:
+			if client.server_add_to_cluster(node['name'],self.database['host'],self.database['user'],
+											self.database['password'],node['ip'],self.database['name']) is None:
+				raise RuntimeError("Server %s is not in a correct state after joining the cluster" % (node['name'],))
+			self.state['joined'].append(node['name'])
+			self.save_state()
+		finally:
+			client.close()
+
+	def run(self):
+		"""
+		Bootstrap the nodes not bootstrapped yet, then join the ones not joined yet.
+
+		:raises RuntimeError: When a node fails. The checkpoint keeps what succeeded
+
+		"""
+		pending = [node for node in self.nodes if node['name'] not in self.state['bootstrapped']]
+		failures = {}
+		if pending:
+			with ThreadPoolExecutor(max_workers=min(self.parallelism,len(pending))) as executor:
+				futures = {executor.submit(self.bootstrap,node):node for node in pending}
+				for future,node in futures.items():
+					if future.exception() is not None:
+						failures[node['name']] = future.exception()
+		if failures:
+			raise RuntimeError("Bootstrap failed on %s: %r" % (', '.join(sorted(failures)),failures))
+
+		for node in self.nodes:
+			if node['name'] not in self.state['joined']:
+				self.join(node)
+		return self.state
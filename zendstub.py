@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+zendstub: local emulator of the Zend Server web API
+
+Speaks the subset of the Web API used by zendclient.py (applications, vhosts,
+directives, extensions, job queues, restarts, tasks and deployments) over an
+in-memory server state. Signatures are not checked. Request bodies may be
+chunked and/or gzipped.
+
+The number of applications/vhosts/directives, the latency of every call, the
+size of the directive documents and the rate of injected 503 failures are
+configurable, which makes it the target of the zendbench.py benchmarks.
+"""
+
+import argparse
+import email.parser
+import gzip
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+
+class ZendState:
+	"""
+	In-memory state of the emulated server.
+	"""
+
+	def __init__(self, applications=10, vhosts=10, directives=100, extensions=20, queues=2,
+	             latency=0.0, failure_rate=0.0, padding=0, task_polls=1, deploy_polls=1):
+		"""
+		:param applications: Number of deployed applications
+		:param vhosts: Number of vhosts (one per application, then extra ones)
+		:param directives: Number of PHP directives
+		:param extensions: Number of PHP extensions
+		:param queues: Number of job queues
+		:param latency: Seconds added to every call
+		:param failure_rate: Probability for a call to fail with a 503
+		:param padding: Size of the description added to every directive, in bytes
+		:param task_polls: tasksComplete answers 'false' that many times after a restart
+		:param deploy_polls: applicationGetStatus answers 'staging' that many times after a deployment
+		"""
+		self.latency = latency
+		self.failure_rate = failure_rate
+		self.padding = padding
+		self.task_polls = task_polls
+		self.deploy_polls = deploy_polls
+		self.lock = threading.Lock()
+		self.pending_tasks = 0
+		self.calls = {}
+
+		self.vhosts = {}
+		for index in range(max(vhosts, applications)):
+			self.add_vhost('http://app%d.example.com:80' % index, 'DocumentRoot /var/www/app%d' % index)
+		self.applications = {}
+		for index in range(applications):
+			self.add_application('app%d' % index, 'http://app%d.example.com:80/' % index, 'App %d' % index, '1.0.0',
+			                     {'env': 'prod', 'db_host': 'db%d.example.com' % index})
+		self.directives = {'directive_%d' % index: str(index % 7) for index in range(directives)}
+		self.extensions = {'extension_%d' % index: ('true' if index % 2 == 0 else 'false') for index in range(extensions)}
+		self.queues = {}
+		for index in range(queues):
+			self.queues[str(index + 1)] = {'id': str(index + 1), 'name': 'queue%d' % index, 'priority': '1',
+			                               'max_http_jobs': '4', 'max_wait_time': '5', 'http_connection_timeout': '30',
+			                               'http_job_timeout': '120', 'http_job_retry_count': '10',
+			                               'http_job_retry_timeout': '1'}
+
+	def add_vhost(self, name, template):
+		vhostid = str(len(self.vhosts) + 1)
+		self.vhosts[vhostid] = {'id': vhostid, 'name': name, 'template': template, 'status': 'Ok'}
+		return self.vhosts[vhostid]
+
+	def add_application(self, name, baseurl, displayname, version, params):
+		applicationid = str(len(self.applications) + 1)
+		self.applications[applicationid] = {'id': applicationid, 'name': name, 'baseUrl': baseurl,
+		                                    'userAppName': displayname, 'version': version, 'params': params,
+		                                    'status': 'deployed', 'polls': 0}
+		return self.applications[applicationid]
+
+	def start_task(self):
+		self.pending_tasks = self.task_polls
+
+
+def element(name, value):
+	return '<%s>%s</%s>' % (name, '' if value is None else escape(str(value)), name)
+
+
+def application_info(application):
+	status = application['status']
+	if application['polls'] > 0:
+		application['polls'] -= 1
+		status = 'staging'
+	elif status == 'staging':
+		status = application['status'] = 'deployed'
+	return ('<applicationInfo>' + element('id', application['id']) + element('baseUrl', application['baseUrl'])
+	        + element('appName', application['name']) + element('userAppName', application['userAppName'])
+	        + element('status', status)
+	        + '<servers><applicationServer>' + element('id', 0) + element('deployedVersion', application['version'])
+	        + element('status', status) + '</applicationServer></servers></applicationInfo>')
+
+
+class ZendHandler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True
+
+	def read_body(self):
+		if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+			body = b''
+			while True:
+				size = int(self.rfile.readline().split(b';')[0], 16)
+				if size == 0:
+					self.rfile.readline()
+					break
+				body += self.rfile.read(size)
+				self.rfile.readline()
+		else:
+			length = int(self.headers.get('Content-Length', 0))
+			body = self.rfile.read(length) if length else b''
+		if self.headers.get('Content-Encoding', '').lower() == 'gzip':
+			body = gzip.decompress(body)
+		return body
+
+	def form(self, body):
+		content_type = self.headers.get('Content-Type', '')
+		if content_type.startswith('multipart/form-data'):
+			message = email.parser.BytesParser().parsebytes(b'Content-Type: ' + content_type.encode('ascii') + b'\r\n\r\n' + body)
+			fields = {}
+			for part in message.get_payload():
+				if part.get_filename() is None:
+					fields[part.get_param('name', header='content-disposition')] = part.get_payload(decode=True).decode('utf-8')
+			return fields
+		return {name: values[-1] for name, values in urllib.parse.parse_qs(body.decode('utf-8')).items()}
+
+	def answer(self):
+		state = self.server.state
+		body = self.read_body()
+		url = urllib.parse.urlparse(self.path)
+		method = url.path.rsplit('/', 1)[-1]
+		query = {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+
+		if state.latency:
+			time.sleep(state.latency)
+		with state.lock:
+			state.calls[method] = state.calls.get(method, 0) + 1
+			if state.failure_rate and random.random() < state.failure_rate:
+				return self.send(503, '<zendServerAPIResponse><errorData><errorCode>serverUnavailable</errorCode></errorData></zendServerAPIResponse>')
+			handler = getattr(self, 'api_' + method, None)
+			if handler is None:
+				data = ''
+			else:
+				data = handler(state, query, self.form(body) if self.command == 'POST' else {})
+		self.send(200, '<?xml version="1.0" encoding="UTF-8"?>\n<zendServerAPIResponse xmlns="http://www.zend.com/server/api/1.9">'
+		               '<requestData><apiKeyName>admin</apiKeyName><method>%s</method></requestData>'
+		               '<responseData>%s</responseData></zendServerAPIResponse>' % (method, data))
+
+	def send(self, code, text):
+		payload = text.encode('utf-8')
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/vnd.zend.serverapi+xml')
+		self.send_header('Content-Length', str(len(payload)))
+		self.end_headers()
+		try:
+			self.wfile.write(payload)
+		except (BrokenPipeError, ConnectionResetError):
+			#The client gave up, e.g. on its read timeout
+			self.close_connection = True
+
+	do_GET = answer
+	do_POST = answer
+
+	def log_message(self, format, *args):
+		pass
+
+	def api_applicationGetStatus(self, state, query, form):
+		applications = state.applications.values()
+		if 'applications[]' in query:
+			applications = [state.applications[query['applications[]']]]
+		return '<applicationsList>' + ''.join(application_info(application) for application in applications) + '</applicationsList>'
+
+	def api_applicationGetDetails(self, state, query, form):
+		application = state.applications[query['application']]
+		params = ''.join('<parameter>' + element('name', name) + element('value', value) + '</parameter>'
+		                 for name, value in sorted(application['params'].items()))
+		#Like Zend Server, does not escape the '&' of the details
+		return ('<applicationDetails>' + application_info(application).replace('&amp;', '&')
+		        + '<applicationPackage><userParams>' + params + '</userParams></applicationPackage></applicationDetails>')
+
+	def deploy(self, state, form, application):
+		application['version'] = application['version'].rsplit('.', 1)[0] + '.' + str(int(application['version'].rsplit('.', 1)[1]) + 1)
+		application['status'] = 'staging'
+		application['polls'] = state.deploy_polls
+		for name, value in form.items():
+			if name.startswith('userParams['):
+				application['params'][name[len('userParams['):-1]] = value
+		return application_info(application)
+
+	def api_applicationDeploy(self, state, query, form):
+		application = state.add_application(form.get('userAppName', 'app').lower().replace(' ', ''), form['baseUrl'],
+		                                    form.get('userAppName', ''), '0.0.0', {})
+		if form.get('createVhost') == 'true':
+			parsed = urllib.parse.urlparse(form['baseUrl'])
+			state.add_vhost('%s://%s:%d' % (parsed.scheme, parsed.hostname, parsed.port or 80), '')
+		return self.deploy(state, form, application)
+
+	def api_applicationUpdate(self, state, query, form):
+		return self.deploy(state, form, state.applications[form['appId']])
+
+	def api_vhostGetStatus(self, state, query, form):
+		return '<vhostList>' + ''.join('<vhostInfo>' + element('id', vhost['id']) + element('name', vhost['name'])
+		                               + '<servers><vhostServer>' + element('id', 0) + element('status', vhost['status'])
+		                               + '</vhostServer></servers></vhostInfo>'
+		                               for vhost in state.vhosts.values()) + '</vhostList>'
+
+	def api_vhostGetDetails(self, state, query, form):
+		vhost = state.vhosts[query['vhost']]
+		return ('<vhostDetails><vhostInfo>' + element('id', vhost['id']) + element('name', vhost['name'])
+		        + '</vhostInfo><vhostExtended>' + element('template', vhost['template']) + '</vhostExtended></vhostDetails>')
+
+	def api_vhostEdit(self, state, query, form):
+		state.vhosts[form['vhostId']]['template'] = form['template']
+		return '<vhostInfo>' + element('id', form['vhostId']) + '</vhostInfo>'
+
+	def api_vhostRedeploy(self, state, query, form):
+		state.vhosts[form['vhost']]['status'] = 'Ok'
+		return '<vhostInfo>' + element('id', form['vhost']) + '</vhostInfo>'
+
+	def api_configurationDirectivesList(self, state, query, form):
+		description = element('description', 'x' * state.padding) if state.padding else ''
+		return '<directives>' + ''.join('<directive>' + element('name', name) + element('section', 'php')
+		                                + element('type', 'string') + element('fileValue', value)
+		                                + element('defaultValue', '') + description + '</directive>'
+		                                for name, value in state.directives.items()) + '</directives>'
+
+	def api_configurationStoreDirectives(self, state, query, form):
+		for name, value in form.items():
+			state.directives[name[len('directives['):-1]] = value
+		return '<directives/>'
+
+	def api_configurationExtensionsList(self, state, query, form):
+		return '<extensions>' + ''.join('<extension>' + element('name', name) + element('loaded', loaded)
+		                                + element('installed', 'true') + '</extension>'
+		                                for name, loaded in state.extensions.items()) + '</extensions>'
+
+	def api_configurationExtensionsOn(self, state, query, form):
+		for name in form.values():
+			state.extensions[name] = 'true'
+		return '<extensions/>'
+
+	def api_configurationExtensionsOff(self, state, query, form):
+		for name in form.values():
+			state.extensions[name] = 'false'
+		return '<extensions/>'
+
+	def api_jobqueueGetQueues(self, state, query, form):
+		return '<queues>' + ''.join('<queue>' + ''.join(element(name, value) for name, value in queue.items()) + '</queue>'
+		                            for queue in state.queues.values()) + '</queues>'
+
+	def api_jobqueueUpdateQueue(self, state, query, form):
+		fields = {'maxHttpJobs': 'max_http_jobs', 'maxWaitTime': 'max_wait_time',
+		          'httpConnectionTimeout': 'http_connection_timeout', 'httpJobTimeout': 'http_job_timeout',
+		          'httpJobRetryCount': 'http_job_retry_count', 'httpJobRetryTimeout': 'http_job_retry_timeout'}
+		queue = state.queues[form['id']]
+		for name, value in form.items():
+			if name != 'id':
+				queue[fields.get(name, name)] = value
+		return '<queue>' + ''.join(element(name, value) for name, value in queue.items()) + '</queue>'
+
+	def api_restartPhp(self, state, query, form):
+		state.start_task()
+		return '<serversList/>'
+
+	def api_restartDaemon(self, state, query, form):
+		state.start_task()
+		return '<serversList/>'
+
+	def api_tasksComplete(self, state, query, form):
+		if state.pending_tasks > 0:
+			state.pending_tasks -= 1
+			return element('tasksComplete', 'false')
+		return element('tasksComplete', 'true')
+
+	def api_clusterGetServerStatus(self, state, query, form):
+		return '<serversList><serverInfo>' + element('id', 0) + element('name', 'emulator') + element('status', 'OK') + '</serverInfo></serversList>'
+
+	def api_libraryVersionDeploy(self, state, query, form):
+		return '<libraryList/>'
+
+
+def start(host='127.0.0.1', port=0, state=None, **options):
+	"""
+	Start the emulator in a background thread and return the server.
+	The "host:port" to give to ZendClient.set_target is in server.target,
+	the ZendState in server.state. options are passed to ZendState.
+	"""
+	server = ThreadingHTTPServer((host, port), ZendHandler)
+	server.daemon_threads = True
+	server.state = ZendState(**options) if state is None else state
+	server.target = '%s:%d' % server.server_address
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	return server
+
+
+def main():
+	arg_parser = argparse.ArgumentParser(description="Local emulator of the Zend Server web API")
+
+	arg_parser.add_argument('--host', dest='host', default='127.0.0.1',
+	                   help="address to listen on")
+	arg_parser.add_argument('--port', dest='port', type=int, default=10081,
+	                   help="port to listen on")
+	arg_parser.add_argument('--applications', dest='applications', type=int, default=10,
+	                   help="number of deployed applications")
+	arg_parser.add_argument('--vhosts', dest='vhosts', type=int, default=10,
+	                   help="number of vhosts")
+	arg_parser.add_argument('--directives', dest='directives', type=int, default=100,
+	                   help="number of PHP directives")
+	arg_parser.add_argument('--latency', dest='latency', type=float, default=0.0,
+	                   help="seconds added to every call")
+	arg_parser.add_argument('--failure-rate', dest='failure_rate', type=float, default=0.0,
+	                   help="probability for a call to fail with a 503")
+	arg_parser.add_argument('--padding', dest='padding', type=int, default=0,
+	                   help="bytes of description added to every directive")
+
+	args = arg_parser.parse_args()
+
+	server = ThreadingHTTPServer((args.host, args.port), ZendHandler)
+	server.state = ZendState(applications=args.applications, vhosts=args.vhosts, directives=args.directives,
+	                         latency=args.latency, failure_rate=args.failure_rate, padding=args.padding)
+	print('Listening on %s:%d' % server.server_address)
+	server.serve_forever()
+
+
+if __name__ == '__main__':
+	main()